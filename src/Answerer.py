@@ -7,34 +7,49 @@ Core of the project,
 the class Answerer contains the method "answer" that given a couple (query, domain) returns an answer;
 and contains the method "query" that given a domain returns a query about something not in the dataset.
 All the other functions gather the necessary data: (these are not individually commented since are self explanatory)
-    1. babelnetId - domain dictionary
+    1. babelnetId - domain store, memory-mapped
     2. relation - relationId dictionary
     3. domain - relation dictionary
     4. relation - queries dictionary
     5. domain list
     6. disambiguator choice
-    7. knowledge base dataset stored in a list of dictionaries
+    7. knowledge base dataset, memory-mapped and accessed like a list of dictionaries
+    8. knowledge base indexes, to find an answer without scanning the whole dataset
+    9. gazetteer of the knowledge base entities, to find the entities of a query without network calls
+    10. query patterns matcher, a query written with a pattern gives directly its relation and its entities text
+    11. enriched facts, (relation, babelnetId) couples learned in the enriching modality and not in the dataset yet
+    12. babelnetId - lemma table, memory-mapped, Babelnet is called only for the babelnetIds not in it
+The answers are kept in an LRU cache (answer_cache.py), the ones about an entity are dropped when the entity is enriched.
+
+The Answerer is set up in stages, timed and run in parallel when they are independent,
+with background=True the setup runs in a thread and the "ready" event tells when the Answerer can be used.
 
 If the code is executed standalone, it is provided an example of usage of the functions
 '''
 
 
-from entity_finder import get_entities_ids, babelnetid_to_lemma
-from Relation_identifier import RelationIdentifier
-import json
+from entity_finder import get_entities_ids, span_entities_ids
+from relation_engine import load_relation_engine
+from online_relation_learner import load_online_learner, learn_enriching_database
+from dataset_store import load_dataset_store, SortedIndex
+from domain_store import load_domain_store, CandidatePool
+from spacy_provider import get_nlp, parse_many
+from gazetteer import load_gazetteer
+from answer_cache import AnswerCache
+from templates import TemplateMatcher
+from lemma_table import LemmaTable
+from journal import replay
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import random
-import spacy
+import threading
+import time
 
 #random.seed(42)
+ONLINE_LEARNING = False  # if True the relations are predicted by a model that keeps learning from the enriching answers
 
-def babelnetid_domain_dict():
-    id_domain_file = "../data/babeldomains_babelnet.txt"
-    id_dom_dict = {}
-    with open(id_domain_file) as f:
-        for line in f:
-            items = line.replace("\n", "").split("\t")
-            id_dom_dict[items[0]] = [items[1]] + [more_domain for more_domain in items[3:]]
-    return id_dom_dict
+def babelnetid_domain_store():
+    return load_domain_store()  # babeldomains_babelnet.txt converted in the memory-mapped format
 
 
 def relation_id_dict():
@@ -84,9 +99,39 @@ def disambiguator_choice(relation_id):
 
 
 def dataset_dicts():
-    with open('../data/clean_dataset.json', encoding="utf8") as json_data:
-        pentaple_dicts = json.load(json_data)
-    return pentaple_dicts
+    return load_dataset_store()  # clean_dataset.json converted in the memory-mapped format
+
+
+def knowledge_index(dataset):
+    """ Builds the lookup indexes of the knowledge base dataset
+
+    For each (relation, babelnetId) couple, where the babelnetId is c1 or c2,
+    and for each (relation, c1, c2) triple is stored the position of the first entry containing it.
+    Keeping the first position, the answer found is the same of a linear scan of the dataset.
+    The indexes are built with vectorized operations on the dataset columns, without decoding any entry.
+
+    Parameters:
+        dataset - knowledge base dataset
+
+    Returns:
+        single_index - index of the (relation, babelnetId) keys
+        pair_index - index of the (relation, c1, c2) keys
+    """
+    positions = np.arange(len(dataset), dtype='<i8')
+    single_index = SortedIndex(dataset.single_keys(), np.concatenate((positions, positions)))
+    pair_index = SortedIndex(dataset.pair_keys(), positions)
+    return single_index, pair_index
+
+
+def enriched_facts(relation_id, path='../data/enriching_database.txt'):
+    """ returns the set of the (relationId, babelnetId) couples of the enriching database, c1 and c2 """
+    facts = set()
+    for entry in replay(path):  # torn or corrupted lines are skipped
+        relation = relation_id.get(entry.get("relation", '').upper())
+        if relation is not None:
+            facts.update((relation, entry[c]) for c in ("c1", "c2") if c in entry)
+    return facts
+
 
 class Answerer():
     """ The core of the model
@@ -94,103 +139,246 @@ class Answerer():
     Contains the method "answer" that given a couple (query, domain) returns an answer;
     and contains the method "query" that given a domain returns a query about something not in the dataset.
     """
-    def __init__(self):
-        self.relation_identifier = RelationIdentifier()  # relation identifier classifier to find the relation of a query
-        self.relation_identifier.training()  # trained
-        self.id_domains = babelnetid_domain_dict()  # babelnetId - domain dict
+    def __init__(self, online_learning=ONLINE_LEARNING, background=False):
+        self.online_learning = online_learning
+        self.ready = threading.Event()  # set when all the stages of the setup are done
+        self.setup_finished = threading.Event()  # set when the setup is done or failed (setup_error)
+        self.stage_times = {}  # stage - seconds
+        self.setup_error = None
+        self.answer_cache = AnswerCache()  # (normalized query, domain) - answer
+        if background:
+            threading.Thread(target=self.setup, daemon=True).start()
+        else:
+            self.setup()
+
+    def setup(self):
+        """ The setup of the model
+
+        The small tables are loaded first since the other stages need them,
+        then the relation identifier, the domains, the knowledge base and the spaCy model are loaded in parallel.
+        The time of each stage is printed and stored in stage_times.
+        """
+        start = time.time()
+        try:
+            self.run_stage('tables', self.load_tables)
+            stages = [('relation identifier', self.load_relation_identifier), ('domains', self.load_domains),
+                      ('knowledge base', self.load_knowledge_base), ('language model', self.load_language_model)]
+            with ThreadPoolExecutor(max_workers=len(stages)) as executor:
+                futures = [executor.submit(self.run_stage, name, stage) for name, stage in stages]
+                for future in futures:
+                    future.result()
+        except Exception as e:
+            self.setup_error = e
+            print('setup failed:', e)
+            self.setup_finished.set()
+            raise
+        self.stage_times['total'] = time.time() - start
+        print('setup done in', round(self.stage_times['total'], 2), 's')
+        self.ready.set()
+        self.setup_finished.set()
+
+    def wait_ready(self):
+        """ waits for the end of the setup, returns True if the model is ready, False if the setup failed """
+        self.setup_finished.wait()
+        return self.ready.is_set()
+
+    def run_stage(self, name, stage):
+        start = time.time()
+        stage()
+        self.stage_times[name] = time.time() - start
+        print('\tstage', name, 'done in', round(self.stage_times[name], 2), 's')
+
+    def load_tables(self):
         self.relation_id = relation_id_dict()  # relation - relationId dict
         self.id_relation = {v: k for k, v in self.relation_id.items()}  # and its inverse
-        self.knowledge_dataset = dataset_dicts()  # dataset list of dicts
         self.domain_rel = domain_relations_dict()  # domain - relation dict
         self.rel_quest = relation_questions_dict()  # relation - queries dict
-        self.spacy_nlp_model = spacy.load('en')  # spaCy NLP model
-
-    def answer(self, query, domain):
+        self.template_matcher = TemplateMatcher()  # query patterns matcher
+
+    def load_relation_identifier(self):
+        if self.online_learning:
+            self.relation_learner = load_online_learner()  # updated by on_enriched
+            # the entries saved after the last checkpoint are learned again, the ones already learned are skipped
+            accepted, rejected = learn_enriching_database(self.relation_learner, self.relation_id)
+            if accepted:
+                self.relation_learner.save()
+            self.relation_identifier = self.relation_learner
+        else:
+            self.relation_learner = None
+            self.relation_identifier = load_relation_engine()  # relation identifier classifier to find the relation of a query
+
+    def load_domains(self):
+        self.id_domains = babelnetid_domain_store()  # babelnetId - domain store
+        self.candidates = CandidatePool(self.id_domains)  # babelnetIds of each domain not asked yet
+        self.lemmas = LemmaTable()  # babelnetId - lemma table
+
+    def load_knowledge_base(self):
+        self.knowledge_dataset = dataset_dicts()  # dataset, accessed like a list of dicts
+        self.single_index, self.pair_index = knowledge_index(self.knowledge_dataset)  # and its indexes
+        self.gazetteer = load_gazetteer(self.relation_id, self.knowledge_dataset)  # surface forms of its entities
+        self.relation_code = {self.relation_id[name]: code for code, name in
+                              enumerate(self.knowledge_dataset.relation_names)}  # relationId - dataset code dict
+        self.enriched_facts = enriched_facts(self.relation_id)  # (relationId, babelnetId) set
+
+    def load_language_model(self):
+        self.spacy_nlp_model = get_nlp()  # spaCy NLP model, shared by the whole process
+
+    def answer(self, query, domain, predicted_relation=None, spacy_doc=None):
         """ The answer method
 
         Given a query and a domain,
-        predicts the relation,
+        predicts the relation (if it is not given),
         finds all entities (babelnetId) contained,
+        (if the query matches a query pattern, the relation is the one of the pattern and the entities are looked up
+        from the text in place of X and Y, the classifier and the entity finders are used only if this fails)
         filters out entities not relevant with the given domain,
         given the predicted relation and the entities found, searches for an answer in the dataset and returns it.
+        The answer of a query already asked in the same domain is taken from the answer cache.
 
         Parameters:
             query - input query
             domain - chosen domain
+            predicted_relation - relationId of the query, predicted here if None
+            spacy_doc - query already parsed by spaCy, parsed here if needed and not given
 
         Returns:
             answer -  a string containing the answer
         """
-        predicted_relation = self.relation_identifier.predict(query)
-        all_babelnetids = get_entities_ids(query, domain=domain, spacy_model=self.spacy_nlp_model,
-                                           spacy_dis=disambiguator_choice(predicted_relation))
+        cached = self.answer_cache.get(query, domain)
+        if cached is not None:
+            return cached.answer
+        all_babelnetids = {}
+        if predicted_relation is None:
+            template_match = self.template_matcher.match(query)
+            if template_match:
+                predicted_relation, spans = template_match
+                all_babelnetids = span_entities_ids(list(spans.values()), domain=domain, gazetteer=self.gazetteer,
+                                                    in_domain=self.id_domains.contains)
+            else:
+                predicted_relation = self.relation_identifier.predict(query)
+        if not all_babelnetids:
+            all_babelnetids = get_entities_ids(query, domain=domain, spacy_model=self.spacy_nlp_model,
+                                               spacy_dis=disambiguator_choice(predicted_relation), spacy_doc=spacy_doc,
+                                               gazetteer=self.gazetteer, in_domain=self.id_domains.contains)
         relevant_babelnetids = {}
         for id in all_babelnetids:
-            try:
-                if domain in self.id_domains[id]:
-                    relevant_babelnetids[id] = all_babelnetids[id]
-            except KeyError:  # if the id is not in babeldomains_babelnet.txt
-                pass
+            if self.id_domains.contains(id, domain):  # False also if the id is not in babeldomains_babelnet.txt
+                relevant_babelnetids[id] = all_babelnetids[id]
         print('\t\tQuery:', query)
         print('\t\tPredicted relation:', self.id_relation[predicted_relation])
         print('\t\tEntities detected:', relevant_babelnetids)
         answer = None
         if not all_babelnetids:  # no entities detected
             answer = "Sorry, I don't understand the object of your question"
-            return answer
-        if not relevant_babelnetids:  # all entities detected are removed since not relevant with the domain
+        elif not relevant_babelnetids:  # all entities detected are removed since not relevant with the domain
             answer = 'Your question is not about ' + domain
-            return answer
         else:  # there is at least one relevant entity
-            for pentaple in self.knowledge_dataset:  # search for an answer in the dataset
-                if len(relevant_babelnetids) == 1:
-                    if (predicted_relation == self.relation_id[pentaple["relation"]]) and (
-                                (pentaple["c1"] in relevant_babelnetids) or (pentaple["c2"] in relevant_babelnetids)):
-                        answer = pentaple["answer"]
-                        break
-                else:
-                    if (predicted_relation == self.relation_id[pentaple["relation"]]) and (
-                                pentaple["c1"] in relevant_babelnetids) and (pentaple["c2"] in relevant_babelnetids):
-                        answer = pentaple["answer"]
-                        break
-        if not answer:  # no answer found
-            answer = 'Sorry, I have not an answer for this question'
+            position = self.answer_position(predicted_relation, relevant_babelnetids)  # search for an answer
+            if position is not None:
+                answer = self.knowledge_dataset[position]["answer"]
+            if not answer:  # no answer found
+                answer = 'Sorry, I have not an answer for this question'
+        self.answer_cache.put(query, domain, answer, predicted_relation, relevant_babelnetids)
         return answer
 
+    def answer_many(self, queries, domain):
+        """ The batch answer method
+
+        Answers a list of queries of the same domain, the relations of all the queries not matching a query pattern
+        are predicted together and the queries disambiguated first with spaCy are parsed together.
+
+        Parameters:
+            queries - list of input queries
+            domain - chosen domain
+
+        Returns:
+            the list of the answers
+        """
+        other_queries = [query for query in queries if not self.template_matcher.match(query)]
+        predicted_relations = dict(zip(other_queries, self.relation_identifier.predict_many(other_queries)))
+        spacy_queries = [query for query in other_queries if disambiguator_choice(predicted_relations[query])]
+        spacy_docs = dict(zip(spacy_queries, parse_many(spacy_queries)))
+        return [self.answer(query, domain, predicted_relation=predicted_relations.get(query),
+                            spacy_doc=spacy_docs.get(query)) for query in queries]
+
+    def on_enriched(self, entry):
+        """ Receives a new entry of the enriching database
+
+        The cached answers about its entities are invalidated and its question is learned by the online relation learner
+
+        Parameters:
+            entry - dict saved by enrich_database
+        """
+        self.answer_cache.invalidate([entry["c1"], entry["c2"]])
+        if entry["relation"] in self.relation_id:
+            self.enriched_facts.update((self.relation_id[entry["relation"]], entry[c]) for c in ("c1", "c2"))
+        if self.relation_learner and entry["relation"] in self.relation_id:
+            self.relation_learner.observe(entry["question"], self.relation_id[entry["relation"]])
+
+    def answer_position(self, relation, babelnetids):
+        """ Searches for an answer in the dataset using the indexes
+
+        With a single entity, it is chosen the first entry with the given relation and the entity as c1 or c2;
+        with more entities, it is chosen the first entry with the given relation and both c1 and c2 among the entities.
+
+        Parameters:
+            relation - relationId of the query
+            babelnetids - relevant entities of the query
+
+        Returns:
+            the position of the entry in the dataset, None if there is no answer
+        """
+        relation_code = self.relation_code.get(relation)
+        codes = [self.knowledge_dataset.encode(id) for id in babelnetids]
+        codes = [code for code in codes if code is not None]  # entities never seen in the dataset are dropped
+        if relation_code is None or not codes:
+            return None
+        if len(babelnetids) == 1:
+            return self.single_index.get(self.knowledge_dataset.single_key(relation_code, codes[0]))
+        positions = [self.pair_index.get(self.knowledge_dataset.pair_key(relation_code, c1, c2))
+                     for c1 in codes for c2 in codes]
+        positions = [position for position in positions if position is not None]
+        return min(positions) if positions else None
+
+    def covered(self, relation, id):
+        """ True if the knowledge base or the enriched facts already have an answer about the relation of the id """
+        return (relation, id) in self.enriched_facts or self.answer_position(relation, [id]) is not None
+
     def query(self, domain):
         """ The query method
 
         Given a domain,
-        scrolls in a random order the babelnetIds in the babelnetId-domain dictionary,
-        if a babelnetId is of the chosen domain, chooses a relation relevant to the domain,
+        draws in a random order the babelnetIds of the chosen domain never drawn before,
+        for each babelnetId chooses a relation relevant to the domain,
+        if the knowledge base (or the enriching database) has not an answer about the relation of the babelnetId
+        (a lookup in the index, the question is not answered),
         chooses a random query pattern among the ones available for the chosen relation,
         formulates the question inserting the babelnetId lemma into the query pattern,
-        raises the question to the "answer" method,
-        if the answer is 'Sorry, I have not an answer for this question'
-        (question with a sense and understood, but without an answer in the dataset),
         returns the question with the chosen relation and the entity (babelnetId).
+        If the lemma lookup fails (Babelnet unreachable or daily limit) the babelnetId is released in the pool
+        and no question is returned, so the babelnetIds are not used up while Babelnet is not available.
 
         Parameters:
             domain - chosen domain
 
         Returns:
-            a dict with the question, its relation and its entity
+            a dict with the question, its relation and its entity, None if no question can be formulated now
         """
-        shuffled_id_list = list(self.id_domains.keys())
-        random.shuffle(shuffled_id_list)
-        for id in shuffled_id_list:
-            if domain in self.id_domains[id]:
-                relation_chosen = random.choice(self.domain_rel[domain])
-                id_lemma = babelnetid_to_lemma(id).replace('_', ' ')
+        id = self.candidates.draw(domain)
+        while id:
+            relation_chosen = random.choice(self.domain_rel[domain])
+            if self.covered(self.relation_id[relation_chosen], id):
+                print("\tQuestion discarded, the bot already knows the answer")
+            else:
+                id_lemma = self.lemmas.lemma(id)
+                if id_lemma is None:  # lookup failed, the babelnetId is asked another time
+                    self.candidates.release(domain, id)
+                    return None
                 if id_lemma:
                     question = random.choice(self.rel_quest[self.relation_id[relation_chosen]]).replace('X', id_lemma)
-                    print("\tPossible question:")
-                    auto_answer = self.answer(question, domain)
-                    if auto_answer == 'Sorry, I have not an answer for this question':
-                        print("\tQuestion found")
-                        return {"query": question, "relation": relation_chosen, "c1": id}
-                    else:
-                        print("\tQuestion discarded, the bot already knows the answer or it did not understand the question")
+                    print("\tQuestion found:", question)
+                    return {"query": question, "relation": relation_chosen, "c1": id}
+            id = self.candidates.draw(domain)
 
 
 def main():  # some examples
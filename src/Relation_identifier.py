@@ -7,22 +7,29 @@ Finds the type of relation expressed in a given query,
 this is accomplished using a support vector machine trained on the provided query patterns for each relation.
 It is used a n-gram representation with unigrams and bigrams.
 Concerning the implementation, the "Relation_identifier" class manages the classifier,
-it prepares the dataset when invoked and has a "training" and "predict" method.
+it prepares the dataset when invoked and has a "training", a "predict" and a "predict_many" (batch) method.
+The trained classifier is saved in data/models, in a file named after a hash of patterns_num.txt,
+of the hyperparameters and of the sklearn version: the next trainings just load it,
+a new training happens only when one of them changes.
+sklearn is imported only when a classifier is trained or loaded,
+the bot serves the predictions with the numpy engine exported from it (relation_engine.py).
 
 Commented code is used for a grid search to find the best parameters for the classifier.
 '''
 
 
-from sklearn.metrics import precision_recall_fscore_support
-from sklearn.pipeline import Pipeline
-from sklearn.feature_selection import SelectKBest, chi2
-from sklearn import svm
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.model_selection import train_test_split, GridSearchCV
-from sklearn.model_selection import StratifiedKFold
-from sklearn.metrics import classification_report
-from sklearn.linear_model import LogisticRegression
+import hashlib
+import json
+import os
+import pickle
+from columnar_file import replaced_atomically
 
+PATTERNS_FILE = '../data/patterns_num.txt'
+MODEL_DIR = '../data/models'
+MAX_FEATURES = 'all'
+SVM_PARAMETERS = {"C": 1., "kernel": 'linear'}
+TEST_SIZE = 0.2
+RANDOM_STATE = 42
 
 
 def svm_clf_training(max_features, data):
@@ -40,9 +47,15 @@ def svm_clf_training(max_features, data):
         clf - the trained classifier
         voc - the vocabulary of the unigrams and bigrams that are considered features
     """
+    from sklearn.pipeline import Pipeline
+    from sklearn.feature_selection import SelectKBest, chi2
+    from sklearn import svm
+    from sklearn.feature_extraction.text import CountVectorizer
+    # from sklearn.model_selection import GridSearchCV
+    # from sklearn.metrics import classification_report
     X_train, y_train, X_test, y_test = data
     clf = Pipeline([('feature_selection', SelectKBest(score_func=chi2, k=max_features)),
-                    ('clf', svm.SVC(C=1., kernel='linear'))])
+                    ('clf', svm.SVC(**SVM_PARAMETERS))])
 
     vectorizer = CountVectorizer(ngram_range=(1, 2), lowercase=True)  # unigrams and bigrams
     X_matrix_tr = vectorizer.fit_transform(X_train)
@@ -83,7 +96,8 @@ def dataset_preparation():
     Returns:
         X_train, y_train, X_test, y_test - the ready-to-eat dataset
     """
-    with open('../data/patterns_num.txt', 'r') as f:
+    from sklearn.model_selection import train_test_split
+    with open(PATTERNS_FILE, 'r') as f:
         data = f.readlines()
         X, Y = [], []
         for line in data:
@@ -91,12 +105,38 @@ def dataset_preparation():
             if len(x) > 5 and x not in X:  # better results are achieved excluding short query patterns
                 X.append(x.replace("X", "").replace("Y", "").lower())
                 Y.append(int(y.replace('\n', '')))
-    test_size = 0.2
+    test_size = TEST_SIZE
     # print('Test size:', test_size, '\nWrong classifications:\n')
 
-    X_train, X_test, y_train, y_test = train_test_split(X, Y, test_size=test_size, random_state=42, stratify=Y)
+    X_train, X_test, y_train, y_test = train_test_split(X, Y, test_size=test_size, random_state=RANDOM_STATE,
+                                                        stratify=Y)
     return X_train, y_train, X_test, y_test
 
+def model_hash(max_features):
+    """ Hash identifying a trained classifier
+
+    Parameters:
+        max_features - maximum number of feature considered
+
+    Returns:
+        the sha256 hex digest of patterns_num.txt and of the hyperparameters
+    """
+    sha = hashlib.sha256()
+    with open(PATTERNS_FILE, 'rb') as f:
+        sha.update(f.read())
+    hyperparameters = {"max_features": max_features, "svm": SVM_PARAMETERS, "test_size": TEST_SIZE,
+                       "random_state": RANDOM_STATE}
+    sha.update(json.dumps(hyperparameters, sort_keys=True).encode('utf8'))
+    return sha.hexdigest()
+
+
+def model_file(max_features):
+    """ file of the pickled classifier, the sklearn version is part of the name since pickles are not portable """
+    import sklearn
+    return os.path.join(MODEL_DIR, 'relation_identifier_' + model_hash(max_features)[:16] +
+                        '_sklearn' + sklearn.__version__ + '.pkl')
+
+
 class RelationIdentifier():
     """ The working class :)
 
@@ -105,15 +145,32 @@ class RelationIdentifier():
     returns the predicted relation of a given text when the predict method is called
     """
     def __init__(self):
-        self.dataset = dataset_preparation()
+        self.dataset = None  # prepared only if a training is needed
         self.model, self.voc = 0, 0
-    def training(self):
+        self.vectorizer = None  # vectorizer with the training vocabulary, built once after the training
+    def training(self, use_saved_model=True):
         """ The training method.
 
         max_features = 'all' (all features maintained) guarantees the best results.
         Ok, I could have omitted the selectKbest step but who knew before? And maybe with another dataset is another story
+        If a classifier trained on the same data with the same hyperparameters was saved, it is loaded instead,
+        otherwise the new classifier is saved.
         """
-        self.model, self.voc = svm_clf_training('all', self.dataset)
+        from sklearn.feature_extraction.text import CountVectorizer
+        max_features = MAX_FEATURES
+        path = model_file(max_features)
+        if use_saved_model and os.path.exists(path):
+            with open(path, 'rb') as f:
+                self.model, self.voc = pickle.load(f)
+            self.vectorizer = CountVectorizer(ngram_range=(1, 2), lowercase=True, vocabulary=self.voc)
+            return 0
+        if self.dataset is None:
+            self.dataset = dataset_preparation()
+        self.model, self.voc = svm_clf_training(max_features, self.dataset)
+        self.vectorizer = CountVectorizer(ngram_range=(1, 2), lowercase=True, vocabulary=self.voc)
+        os.makedirs(MODEL_DIR, exist_ok=True)
+        with replaced_atomically(path) as temporary_path, open(temporary_path, 'wb') as f:
+            pickle.dump((self.model, self.voc), f)
         return 0
     def predict(self, text):
         """ The predict method
@@ -129,9 +186,22 @@ class RelationIdentifier():
         Returns:
             the id of the predicted relation
         """
-        vectorizer = CountVectorizer(ngram_range=(1, 2), lowercase=True, vocabulary=self.voc)
-        vector = vectorizer.fit_transform([text])
-        return self.model.predict(vector)[0]
+        return self.predict_many([text])[0]
+    def predict_many(self, texts):
+        """ The batch predict method
+
+        The texts are vectorized together in a single sparse matrix, with the vectorizer built after the training,
+        and classified with a single call of the classifier.
+
+        Parameters:
+            texts - list of input queries
+
+        Returns:
+            the list of the ids of the predicted relations
+        """
+        if not texts:
+            return []
+        return self.model.predict(self.vectorizer.transform(texts)).tolist()
 
 
 
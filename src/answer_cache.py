@@ -0,0 +1,112 @@
+'''
+Author: Antonio Norelli
+NLP final project
+
+answer_cache.py
+LRU cache of the answers of the Answerer, keyed by (normalized question, domain).
+A question is normalized in lowercase, with single spaces and without the final question mark,
+so trivially different versions of the same question share the same answer.
+Each cached answer records the predicted relation and the entities detected in the question:
+when new facts about an entity are added to the knowledge base, the answers involving it are invalidated.
+Hit ratio and approximate memory used are exposed by the "stats" method.
+'''
+
+
+import collections
+import re
+import sys
+import threading
+
+MAX_ENTRIES = 10000  # answers kept in the cache, the least recently used are evicted
+
+CachedAnswer = collections.namedtuple('CachedAnswer', ['answer', 'relation', 'entities', 'size'])
+
+
+def normalize(text):
+    """ lowercase text with single spaces and without the final question marks """
+    return re.sub(r'\s+', ' ', text.lower()).strip().rstrip('?').strip()
+
+
+class AnswerCache():
+    """ Thread-safe LRU cache of answers, invalidated by entity """
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()  # key - CachedAnswer, from the least to the most recently used
+        self.entity_keys = collections.defaultdict(set)  # babelnetId - keys of the answers involving it
+        self.hits, self.misses, self.invalidations = 0, 0, 0
+        self.memory = 0  # approximate bytes of the cached entries
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(query, domain):
+        return normalize(query), domain
+
+    def get(self, query, domain):
+        """ returns the CachedAnswer of a question in a domain, None if it is not cached """
+        key = self.key(query, domain)
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return cached
+
+    def put(self, query, domain, answer, relation, entities):
+        """ Caches an answer
+
+        Parameters:
+            query - input query
+            domain - chosen domain
+            answer - answer of the query
+            relation - predicted relationId of the query
+            entities - babelnetIds of the relevant entities detected in the query
+        """
+        key = self.key(query, domain)
+        entities = tuple(entities)
+        size = (sys.getsizeof(key[0]) + sys.getsizeof(domain) + sys.getsizeof(answer) + sys.getsizeof(entities) +
+                sum(sys.getsizeof(id) for id in entities))
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = CachedAnswer(answer, relation, entities, size)
+            self.memory += size
+            for id in entities:
+                self.entity_keys[id].add(key)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        cached = self.entries.pop(key)
+        self.memory -= cached.size
+        for id in cached.entities:
+            keys = self.entity_keys[id]
+            keys.discard(key)
+            if not keys:
+                del self.entity_keys[id]
+
+    def invalidate(self, ids):
+        """ removes the answers involving any of the given babelnetIds, returns how many are removed """
+        with self.lock:
+            keys = set()
+            for id in ids:
+                keys.update(self.entity_keys.get(id, ()))
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.entity_keys.clear()
+            self.memory = 0
+
+    def stats(self):
+        """ returns a dict with size, hit ratio, invalidations and approximate memory (bytes) of the cache """
+        with self.lock:
+            requests = self.hits + self.misses
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                    "hit_ratio": float(self.hits) / requests if requests else 0., "invalidations": self.invalidations,
+                    "memory": self.memory}
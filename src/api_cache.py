@@ -0,0 +1,141 @@
+'''
+Author: Antonio Norelli
+NLP final project
+
+api_cache.py
+Persistent cache of the Babelnet and Babelfy API responses, stored in a SQLite database.
+The same synsets and questions come up again and again (users, Answerer.query self-checks, performance evaluation),
+caching the responses saves time and babelcoins.
+    - responses are keyed by endpoint and normalized parameters (sorted, without the API key)
+    - every entry expires after a time to live, empty responses (negative entries) have a shorter one
+    - when the cache is full, the least recently used entries are deleted
+    - the access times of the hits are kept in memory and written in batches, so a hit does not write on disk
+    - hits and misses are counted
+The database can be shared by several threads and processes.
+'''
+
+
+import atexit
+import json
+import sqlite3
+import threading
+import time
+
+CACHE_FILE = '../data/api_cache.sqlite'
+TTL = 30 * 24 * 3600  # seconds, the synsets rarely change
+NEGATIVE_TTL = 24 * 3600  # seconds, a missing result may be added or may be a temporary error
+MAX_ENTRIES = 200000
+EVICTION_CHECK = 1000  # the size of the cache is checked every EVICTION_CHECK insertions
+ACCESS_BATCH = 500  # access times of the hits written together
+
+
+def normalize_params(params):
+    """ takes the parameters of an API call, returns them in a canonical form, without the API key """
+    return sorted((str(name), str(value)) for name, value in params.items() if name != 'key')
+
+
+class ResponseCache():
+    """ SQLite backed LRU cache of json responses """
+    def __init__(self, path=CACHE_FILE, ttl=TTL, negative_ttl=NEGATIVE_TTL, max_entries=MAX_ENTRIES):
+        self.ttl, self.negative_ttl, self.max_entries = ttl, negative_ttl, max_entries
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')  # with WAL, a commit does not wait for a disk sync
+        self.connection.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT, '
+                                'negative INTEGER, created REAL, accessed REAL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self.connection.commit()
+        self.hits, self.negative_hits, self.misses, self.insertions = 0, 0, 0, 0
+        self.accessed = {}  # key - access time of the hits not written yet
+
+    @staticmethod
+    def key(endpoint, params):
+        return endpoint + '?' + json.dumps(normalize_params(params))
+
+    def get(self, endpoint, params):
+        """ Looks for a response in the cache
+
+        Parameters:
+            endpoint - url of the API without parameters
+            params - dict of the parameters of the call
+
+        Returns:
+            found - True if a valid response is cached
+            response - the cached json response, None if not found
+        """
+        key = self.key(endpoint, params)
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute('SELECT response, negative, created FROM responses WHERE key = ?',
+                                          (key,)).fetchone()
+            if row is None or now - row[2] > (self.negative_ttl if row[1] else self.ttl):
+                self.misses += 1
+                return False, None
+            self.accessed[key] = now
+            if len(self.accessed) >= ACCESS_BATCH:
+                self._write_accessed()
+                self.connection.commit()
+            self.hits += 1
+            self.negative_hits += row[1]
+        return True, json.loads(row[0])
+
+    def put(self, endpoint, params, response, negative=False):
+        """ Stores a response in the cache
+
+        Parameters:
+            endpoint - url of the API without parameters
+            params - dict of the parameters of the call
+            response - json response
+            negative - True if the response has no results
+        """
+        now = time.time()
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                                    (self.key(endpoint, params), json.dumps(response), int(negative), now, now))
+            self.insertions += 1
+            if self.insertions % EVICTION_CHECK == 0:
+                self._write_accessed()
+                self._evict()
+            self.connection.commit()
+
+    def _write_accessed(self):  # called holding the lock, committed by the caller
+        if self.accessed:
+            self.connection.executemany('UPDATE responses SET accessed = ? WHERE key = ?',
+                                        [(accessed, key) for key, accessed in self.accessed.items()])
+            self.accessed = {}
+
+    def flush(self):
+        """ writes the access times not written yet """
+        with self.lock:
+            self._write_accessed()
+            self.connection.commit()
+
+    def _evict(self):
+        size = self.connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        if size > self.max_entries:  # least recently used entries are deleted
+            self.connection.execute('DELETE FROM responses WHERE key IN '
+                                    '(SELECT key FROM responses ORDER BY accessed LIMIT ?)',
+                                    (size - self.max_entries,))
+
+    def stats(self):
+        """ returns a dict with the counters of the cache """
+        with self.lock:
+            size = self.connection.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+        requests = self.hits + self.misses
+        return {"hits": self.hits, "negative_hits": self.negative_hits, "misses": self.misses,
+                "hit_ratio": float(self.hits) / requests if requests else 0., "entries": size}
+
+
+shared_cache = None
+shared_cache_lock = threading.Lock()
+
+
+def get_shared_cache():
+    """ returns the process-wide cache, opened on first use """
+    global shared_cache
+    with shared_cache_lock:
+        if shared_cache is None:
+            shared_cache = ResponseCache()
+            atexit.register(shared_cache.flush)  # access times still in memory
+    return shared_cache
@@ -0,0 +1,104 @@
+'''
+Author: Antonio Norelli
+NLP final project
+
+async_chatbot.py
+asyncio runtime of the Telegram bot, alternative to the main loop of telegram_chatbot.py.
+The updates are fetched with an async HTTP client and dispatched concurrently among the chats,
+so a user waiting for a slow chain of Babelfy and Babelnet calls does not block the other users.
+    - every chat has its own queue of updates, consumed by a single task: the messages of a chat are answered in order
+    - the "answer" function of telegram_chatbot, with its context variables, is run unchanged in a thread pool
+    - at most MAX_CONVERSATIONS updates are processed at the same time
+As telegram_chatbot.main, it exits with an error status if the setup of the model fails.
+'''
+
+
+import asyncio
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from http_client import AsyncHttpClient, CONNECT_TIMEOUT
+from telegram_chatbot import URL, LONG_POLLING_TIMEOUT, answer, get_last_update_id, start_model, model_failed
+
+MAX_CONVERSATIONS = 8  # maximum number of updates processed concurrently
+POLLING_INTERVAL = 0.5  # seconds between two getUpdates calls
+
+
+class ChatRuntime():
+    """ Dispatches the Telegram updates to per-chat tasks
+
+    Every user interacting with the bot has its own context variables stored in the dict "chats"
+    that has as keys the id of each user, as in telegram_chatbot.main
+    """
+    def __init__(self, max_conversations=MAX_CONVERSATIONS):
+        self.client = AsyncHttpClient()
+        self.chats = {}  # chat - context variables
+        self.queues = {}  # chat - queue of updates not answered yet
+        self.workers = {}  # chat - task answering the updates of the chat
+        self.slots = asyncio.Semaphore(max_conversations)
+        self.executor = ThreadPoolExecutor(max_workers=max_conversations)
+
+    async def get_updates(self, offset=None):
+        """ async version of telegram_chatbot.get_updates """
+        url = URL + "getUpdates?timeout={}".format(LONG_POLLING_TIMEOUT)
+        if offset:
+            url += "&offset={}".format(offset)
+        response = await self.client.get(url, timeout=(CONNECT_TIMEOUT, LONG_POLLING_TIMEOUT + 10))
+        return response.json()
+
+    def dispatch(self, update):
+        """ puts an update in the queue of its chat, starting the task of the chat if it is not running """
+        chat = update["message"]["chat"]["id"]
+        if chat not in self.chats:
+            self.chats[chat] = (None, None, None, 0)  # mode, domain, question, step
+            self.queues[chat] = asyncio.Queue()
+        self.queues[chat].put_nowait(update)
+        if chat not in self.workers:
+            self.workers[chat] = asyncio.ensure_future(self.chat_worker(chat))
+
+    async def chat_worker(self, chat):
+        """ answers the updates of a chat one at a time, ends when the queue of the chat is empty """
+        loop = asyncio.get_running_loop()
+        queue = self.queues[chat]
+        try:
+            while not queue.empty():
+                update = queue.get_nowait()
+                async with self.slots:
+                    print('chat:', chat)
+                    context = await loop.run_in_executor(self.executor, answer, update, chat, self.chats[chat])
+                if context is None:  # answer failed and already printed the exception, the conversation restarts
+                    context = (None, None, None, 0)
+                self.chats[chat] = context
+        finally:
+            del self.workers[chat]
+
+    async def run(self):
+        """ polls the updates until the setup of the model fails """
+        last_update_id = None
+        while True:
+            if model_failed():  # the error is printed by the setup, a supervisor can restart the bot
+                print('exiting, the setup of the model failed')
+                sys.exit(1)
+            try:
+                updates = await self.get_updates(last_update_id)
+            except Exception as e:  # catch exception to keep the bot running
+                print(e)
+                updates = {"result": []}
+            if len(updates.get("result", [])) > 0:
+                last_update_id = get_last_update_id(updates) + 1
+                for update in updates["result"]:
+                    if "message" in update:
+                        self.dispatch(update)
+            await asyncio.sleep(POLLING_INTERVAL)
+
+
+async def serve():
+    await ChatRuntime().run()  # created inside the event loop, that owns its queues and semaphore
+
+
+def main():
+    start_model()
+    asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    main()
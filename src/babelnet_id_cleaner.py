@@ -4,10 +4,12 @@ NLP final project
 
 babelnet_id_cleaner.py
 Standardizes the data in dataset.json, the clean dataset is stored in clean_dataset.json
+and then converted in the memory-mapped format used by the bot (clean_dataset.bin)
 '''
 
 
 import json
+from dataset_store import build_dataset_store
 with open('../data/dataset.json', encoding="utf8") as json_data:
     dicts = json.load(json_data)
 with open('../data/clean_dataset.json', 'w', encoding="utf8") as f:
@@ -43,3 +45,4 @@ with open('../data/clean_dataset.json', 'w', encoding="utf8") as f:
                 flag = 1
             f.write(s)
     f.write(']')
+print('Number of entries stored:', build_dataset_store())
@@ -0,0 +1,136 @@
+'''
+Author: Antonio Norelli
+NLP final project
+
+columnar_file.py
+Reads and writes the compact binary files used to store the big data of the bot (dataset, domains, lemmas).
+A file is composed by a magic string, a json header and a sequence of numpy columns aligned to 8 bytes.
+The header contains the position and the type of each column and some free metadata.
+The columns are read as memory-mapped numpy arrays, so nothing is loaded in memory until it is used.
+The generated files are written through replaced_atomically, so the readers never see a half written file.
+'''
+
+
+import contextlib
+import json
+import os
+import threading
+import numpy as np
+
+MAGIC = b'KBOTCOL1'
+ALIGNMENT = 8
+
+
+def _padding(size):
+    return (ALIGNMENT - size % ALIGNMENT) % ALIGNMENT
+
+
+@contextlib.contextmanager
+def replaced_atomically(path, suffix=''):
+    """ Context manager giving a temporary path that replaces path when the block ends without errors
+
+    The file is written apart and renamed, so the other workers (and the memory-mapped readers)
+    keep seeing the old file until the new one is complete. On errors the temporary file is removed.
+
+    Parameters:
+        path - final file
+        suffix - end of the temporary name, for the writers that add an extension (e.g. '.npz' for np.savez)
+
+    Returns:
+        the temporary path, unique for each process and thread
+    """
+    temporary_path = '%s.%d.%d%s' % (path, os.getpid(), threading.get_ident(), suffix)
+    try:
+        yield temporary_path
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+def write_columns(path, columns, meta=None):
+    """ Writes a columnar file
+
+    Parameters:
+        path - output file
+        columns - dict {column name: numpy array}, arrays are stored flattened
+        meta - json serializable metadata stored in the header
+
+    Returns:
+        the number of bytes written
+    """
+    columns = {name: np.ascontiguousarray(array).ravel() for name, array in columns.items()}
+    layout, offset = {}, 0
+    for name, array in columns.items():
+        layout[name] = {"dtype": array.dtype.str, "offset": offset, "length": len(array)}
+        offset += array.nbytes + _padding(array.nbytes)
+    header = json.dumps({"meta": meta or {}, "columns": layout}).encode('utf8')
+    header += b' ' * _padding(len(MAGIC) + 8 + len(header))
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(header)).tobytes())
+        f.write(header)
+        for array in columns.values():
+            f.write(array.tobytes())
+            f.write(b'\0' * _padding(array.nbytes))
+    return len(MAGIC) + 8 + len(header) + offset
+
+
+def read_columns(path):
+    """ Opens a columnar file
+
+    Parameters:
+        path - input file
+
+    Returns:
+        meta - the metadata stored in the header
+        columns - dict {column name: read-only memory-mapped numpy array}
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(path + ' is not a columnar file')
+        header_size = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+        header = json.loads(f.read(header_size).decode('utf8'))
+    data_start = len(MAGIC) + 8 + header_size
+    columns = {}
+    for name, column in header["columns"].items():
+        if column["length"]:
+            columns[name] = np.memmap(path, dtype=np.dtype(column["dtype"]), mode='r',
+                                      offset=data_start + column["offset"], shape=(column["length"],))
+        else:  # numpy can not map an empty region
+            columns[name] = np.empty(0, dtype=np.dtype(column["dtype"]))
+    return header["meta"], columns
+
+
+class StringHeap():
+    """ Offset-indexed list of strings
+
+    The strings are stored encoded in utf8 one after the other in a bytes column,
+    the i-th string goes from offsets[i] to offsets[i + 1]. Strings are decoded only when requested.
+    """
+    def __init__(self, offsets, heap):
+        self.offsets = offsets
+        self.heap = heap
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position):
+        return bytes(self.heap[self.offsets[position]:self.offsets[position + 1]]).decode('utf8')
+
+    @staticmethod
+    def build(strings):
+        """ Encodes a list of strings
+
+        Parameters:
+            strings - iterable of strings
+
+        Returns:
+            offsets, heap - the two numpy columns of the string heap
+        """
+        encoded = [string.encode('utf8') for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype='<u8')
+        offsets[1:] = np.cumsum([len(item) for item in encoded], dtype='<u8')
+        heap = np.frombuffer(b''.join(encoded), dtype='u1')
+        return offsets, heap
@@ -0,0 +1,203 @@
+'''
+Author: Antonio Norelli
+NLP final project
+
+dataset_store.py
+Compact memory-mapped version of clean_dataset.json.
+The babelnetIds and the relations are integer encoded and stored in columns,
+the questions and the answers are stored in two string heaps and decoded only when requested.
+The DatasetStore class behaves like the list of dicts returned by json.load, so it can be used in its place.
+
+When executed standalone, it builds clean_dataset.bin from clean_dataset.json
+'''
+
+
+import json
+import os
+import numpy as np
+from columnar_file import write_columns, read_columns, replaced_atomically, StringHeap
+
+JSON_DATASET_FILE = '../data/clean_dataset.json'
+DATASET_FILE = '../data/clean_dataset.bin'
+
+POS_TAGS = 'nvar'  # babelnetId part of speech: noun, verb, adjective, adverb
+IRREGULAR_ID_BASE = 400000000  # the codes of the regular babelnetIds are smaller than this
+RELATION_BITS = 5  # the relation code is stored in the lowest bits of the index keys
+ID_BITS = 29  # a babelnetId code fits in 29 bits
+
+
+def encode_babelnet_id(id):
+    """ takes a regular babelnetId (e.g. bn:00012345n), returns its integer code
+
+    Parameters:
+        id - babelnetId
+
+    Returns:
+        the integer code, None if the babelnetId is not in the regular format
+    """
+    if len(id) != 12 or id[:3] != 'bn:' or not id[3:11].isdigit() or id[11] not in POS_TAGS:
+        return None
+    return int(id[3:11]) * len(POS_TAGS) + POS_TAGS.index(id[11])
+
+
+def decode_babelnet_id(code):
+    """ takes the integer code of a regular babelnetId, returns the babelnetId
+
+    Parameters:
+        code - integer code
+
+    Returns:
+        the babelnetId in a string
+    """
+    number, pos = divmod(int(code), len(POS_TAGS))
+    return 'bn:%08d%s' % (number, POS_TAGS[pos])
+
+
+def build_dataset_store(json_file=JSON_DATASET_FILE, dataset_file=DATASET_FILE):
+    """ Converts the cleaned dataset in the columnar format
+
+    The babelnetIds that are not in the regular format (the cleaner is not perfect) are stored in a list in the header
+    and encoded with their position in the list plus IRREGULAR_ID_BASE.
+
+    Parameters:
+        json_file - clean dataset in json format
+        dataset_file - output file
+
+    Returns:
+        the number of entries stored
+    """
+    with open(json_file, encoding="utf8") as json_data:
+        pentaple_dicts = json.load(json_data)
+    relation_names, irregular_ids = [], []
+    relation_codes, irregular_codes = {}, {}
+
+    def code(id):
+        id_code = encode_babelnet_id(id)
+        if id_code is None:
+            if id not in irregular_codes:
+                irregular_codes[id] = IRREGULAR_ID_BASE + len(irregular_ids)
+                irregular_ids.append(id)
+            id_code = irregular_codes[id]
+        return id_code
+
+    relations = np.zeros(len(pentaple_dicts), dtype='u1')
+    c1 = np.zeros(len(pentaple_dicts), dtype='<u4')
+    c2 = np.zeros(len(pentaple_dicts), dtype='<u4')
+    for position, pentaple in enumerate(pentaple_dicts):
+        if pentaple["relation"] not in relation_codes:
+            relation_codes[pentaple["relation"]] = len(relation_names)
+            relation_names.append(pentaple["relation"])
+        relations[position] = relation_codes[pentaple["relation"]]
+        c1[position] = code(pentaple["c1"])
+        c2[position] = code(pentaple["c2"])
+    if len(relation_names) >= 2 ** RELATION_BITS or len(irregular_ids) >= 2 ** ID_BITS - IRREGULAR_ID_BASE:
+        raise ValueError('the dataset does not fit in the columnar format')
+    question_offsets, question_heap = StringHeap.build(pentaple["question"] for pentaple in pentaple_dicts)
+    answer_offsets, answer_heap = StringHeap.build(pentaple["answer"] for pentaple in pentaple_dicts)
+    with replaced_atomically(dataset_file) as temporary_path:  # the store may be memory-mapped by running bots
+        write_columns(temporary_path, {"relation": relations, "c1": c1, "c2": c2,
+                                       "question_offsets": question_offsets, "question_heap": question_heap,
+                                       "answer_offsets": answer_offsets, "answer_heap": answer_heap},
+                      meta={"relation_names": relation_names, "irregular_ids": irregular_ids})
+    return len(pentaple_dicts)
+
+
+class SortedIndex():
+    """ Maps integer keys to the first position in which they appear
+
+    Keys and positions are kept in two sorted numpy arrays, a lookup is a binary search.
+    """
+    def __init__(self, keys, positions):
+        order = np.lexsort((positions, keys))  # sorted by key, then by position
+        self.keys, first = np.unique(keys[order], return_index=True)
+        self.positions = positions[order][first]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get(self, key):
+        i = int(np.searchsorted(self.keys, key))
+        if i < len(self.keys) and self.keys[i] == key:
+            return int(self.positions[i])
+        return None
+
+
+class DatasetStore():
+    """ Read-only memory-mapped knowledge base dataset
+
+    Behaves like a list of dicts with the keys "question", "answer", "relation", "c1" and "c2",
+    each entry is decoded only when accessed.
+    The raw columns (relation codes, c1 and c2 codes) are available for fast vectorized operations.
+    """
+    def __init__(self, dataset_file=DATASET_FILE):
+        meta, columns = read_columns(dataset_file)
+        self.relation_names = meta["relation_names"]
+        self.irregular_ids = meta["irregular_ids"]
+        self.irregular_codes = {id: IRREGULAR_ID_BASE + i for i, id in enumerate(self.irregular_ids)}
+        self.relations, self.c1, self.c2 = columns["relation"], columns["c1"], columns["c2"]
+        self.questions = StringHeap(columns["question_offsets"], columns["question_heap"])
+        self.answers = StringHeap(columns["answer_offsets"], columns["answer_heap"])
+
+    def __len__(self):
+        return len(self.relations)
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError('dataset entry out of range')
+        return {"question": self.questions[position],
+                "answer": self.answers[position],
+                "relation": self.relation_names[self.relations[position]],
+                "c1": self.decode(self.c1[position]),
+                "c2": self.decode(self.c2[position])}
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self[position]
+
+    def encode(self, id):
+        """ integer code of a babelnetId, None if the babelnetId is not in the dataset format """
+        code = encode_babelnet_id(id)
+        return code if code is not None else self.irregular_codes.get(id)
+
+    def decode(self, code):
+        """ babelnetId of an integer code """
+        if code >= IRREGULAR_ID_BASE:
+            return self.irregular_ids[code - IRREGULAR_ID_BASE]
+        return decode_babelnet_id(code)
+
+    def single_keys(self):
+        """ index keys of the (relation, c1) and (relation, c2) couples, in this order """
+        relations = self.relations.astype('<i8')
+        return np.concatenate(((self.c1.astype('<i8') << RELATION_BITS) | relations,
+                               (self.c2.astype('<i8') << RELATION_BITS) | relations))
+
+    def pair_keys(self):
+        """ index keys of the (relation, c1, c2) triples """
+        return ((self.c1.astype('<i8') << (ID_BITS + RELATION_BITS)) | (self.c2.astype('<i8') << RELATION_BITS) |
+                self.relations.astype('<i8'))
+
+    @staticmethod
+    def single_key(relation_code, code):
+        return (code << RELATION_BITS) | relation_code
+
+    @staticmethod
+    def pair_key(relation_code, c1_code, c2_code):
+        return (c1_code << (ID_BITS + RELATION_BITS)) | (c2_code << RELATION_BITS) | relation_code
+
+
+def load_dataset_store(json_file=JSON_DATASET_FILE, dataset_file=DATASET_FILE):
+    """ Opens the dataset store, building it first if it is missing or older than the json dataset """
+    if not os.path.exists(dataset_file) or (
+                os.path.exists(json_file) and os.path.getmtime(dataset_file) < os.path.getmtime(json_file)):
+        print('\t\tbuilding', dataset_file, '...')
+        build_dataset_store(json_file, dataset_file)
+    return DatasetStore(dataset_file)
+
+
+def main():
+    print('Number of entries stored:', build_dataset_store())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+'''
+Author: Antonio Norelli
+NLP final project
+
+domain_store.py
+Compact memory-mapped version of babeldomains_babelnet.txt.
+The babelnetIds are integer encoded and sorted (the irregular ones as in dataset_store.py), the domains of each babelnetId are stored in a 64 bit mask,
+one bit for each domain (the bits are assigned following domain_list.txt).
+The DomainStore class answers if a babelnetId belongs to a domain with a binary search,
+and returns all the babelnetIds of a domain with a vectorized scan of the masks.
+The CandidatePool class draws random babelnetIds of a domain without replacement, for the enriching questions.
+
+When executed standalone, it builds babeldomains_babelnet.bin from babeldomains_babelnet.txt
+'''
+
+
+import array
+import os
+import random
+import threading
+import numpy as np
+from columnar_file import write_columns, read_columns, replaced_atomically
+from dataset_store import encode_babelnet_id, decode_babelnet_id, IRREGULAR_ID_BASE, ID_BITS
+
+TEXT_DOMAIN_FILE = '../data/babeldomains_babelnet.txt'
+DOMAIN_FILE = '../data/babeldomains_babelnet.bin'
+DOMAIN_LIST_FILE = '../data/domain_list.txt'
+MAX_DOMAINS = 64
+
+
+def build_domain_store(text_file=TEXT_DOMAIN_FILE, domain_file=DOMAIN_FILE, domain_list_file=DOMAIN_LIST_FILE):
+    """ Converts babeldomains_babelnet.txt in the columnar format
+
+    Each line is parsed as in the original babelnetId - domain dictionary: the domains are the second field
+    and all the fields after the third. If a babelnetId appears twice, the last line is kept.
+    The babelnetIds not in the regular format are kept in a list saved in the header of the file
+    and encoded with their position in the list plus IRREGULAR_ID_BASE, as in the dataset store.
+    Domains absent in domain_list.txt get the first free bits.
+
+    Parameters:
+        text_file - babelnetId - domains text file
+        domain_file - output file
+        domain_list_file - list of the domains, gives the order of the bits
+
+    Returns:
+        the number of babelnetIds stored
+    """
+    with open(domain_list_file) as f:
+        domain_names = [line.replace('\n', '') for line in f.readlines() if line.strip()]
+    domain_bits = {domain: i for i, domain in enumerate(domain_names)}
+    codes, masks = array.array('q'), array.array('Q')
+    irregular_ids, irregular_codes = [], {}
+    with open(text_file) as f:
+        for line in f:
+            items = line.replace("\n", "").split("\t")
+            code = encode_babelnet_id(items[0])
+            if code is None:
+                if items[0] not in irregular_codes:
+                    irregular_codes[items[0]] = IRREGULAR_ID_BASE + len(irregular_ids)
+                    irregular_ids.append(items[0])
+                code = irregular_codes[items[0]]
+            mask = 0
+            for domain in [items[1]] + items[3:]:
+                if domain not in domain_bits:
+                    if len(domain_names) == MAX_DOMAINS:
+                        raise ValueError('more than ' + str(MAX_DOMAINS) + ' domains in ' + text_file)
+                    domain_bits[domain] = len(domain_names)
+                    domain_names.append(domain)
+                mask |= 1 << domain_bits[domain]
+            codes.append(code)
+            masks.append(mask)
+    if len(irregular_ids) >= 2 ** ID_BITS - IRREGULAR_ID_BASE:
+        raise ValueError('too many irregular babelnetIds in ' + text_file)
+    codes = np.frombuffer(codes, dtype='<i8')[::-1]  # reversed, so np.unique keeps the last occurrence
+    masks = np.frombuffer(masks, dtype='<u8')[::-1]
+    codes, last = np.unique(codes, return_index=True)
+    with replaced_atomically(domain_file) as temporary_path:  # the store may be memory-mapped by running bots
+        write_columns(temporary_path, {"id": codes.astype('<u4'), "mask": masks[last]},
+                      meta={"domains": domain_names, "irregular_ids": irregular_ids})
+    return len(codes)
+
+
+class DomainStore():
+    """ Read-only memory-mapped babelnetId - domains store
+
+    The babelnetIds can be given as strings or as integer codes.
+    """
+    def __init__(self, domain_file=DOMAIN_FILE):
+        meta, columns = read_columns(domain_file)
+        self.domain_names = meta["domains"]
+        self.irregular_ids = meta.get("irregular_ids", [])  # missing in the stores built before
+        self.irregular_codes = {id: IRREGULAR_ID_BASE + i for i, id in enumerate(self.irregular_ids)}
+        self.domain_bits = {domain: np.uint64(1 << i) for i, domain in enumerate(self.domain_names)}
+        self.ids, self.masks = columns["id"], columns["mask"]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id):
+        return self._position(id) is not None
+
+    def _position(self, id):
+        code = self.encode(id) if isinstance(id, str) else id
+        if code is None:
+            return None
+        i = int(np.searchsorted(self.ids, code))
+        if i < len(self.ids) and self.ids[i] == code:
+            return i
+        return None
+
+    def mask(self, id):
+        """ domain mask of a babelnetId, 0 if the babelnetId is not in the store """
+        position = self._position(id)
+        return 0 if position is None else int(self.masks[position])
+
+    def domains(self, id):
+        """ list of the domains of a babelnetId, empty if the babelnetId is not in the store """
+        mask = self.mask(id)
+        return [domain for i, domain in enumerate(self.domain_names) if mask >> i & 1]
+
+    def contains(self, id, domain):
+        """ True if the babelnetId belongs to the domain """
+        bit = self.domain_bits.get(domain)
+        return bit is not None and bool(self.mask(id) & int(bit))
+
+    def ids_in_domain(self, domain):
+        """ sorted numpy array with the integer codes of all the babelnetIds of the domain """
+        bit = self.domain_bits.get(domain)
+        if bit is None:
+            return np.empty(0, dtype=self.ids.dtype)
+        return self.ids[(self.masks & bit) != 0]
+
+    def encode(self, id):
+        """ integer code of a babelnetId, None if the babelnetId is irregular and not in the store """
+        code = encode_babelnet_id(id)
+        return code if code is not None else self.irregular_codes.get(id)
+
+    def decode(self, code):
+        """ babelnetId of an integer code """
+        if code >= IRREGULAR_ID_BASE:
+            return self.irregular_ids[code - IRREGULAR_ID_BASE]
+        return decode_babelnet_id(code)
+
+
+class CandidatePool():
+    """ Random babelnetIds of a domain, drawn without replacement
+
+    The babelnetIds of a domain are copied from the store in an array the first time the domain is requested.
+    Each draw is a step of a Fisher-Yates shuffle: a random babelnetId among the ones not drawn yet
+    is swapped at the end of the not drawn part, that shrinks by one.
+    So a draw costs O(1) and a babelnetId already drawn (asked or rejected) is never offered again for that domain.
+    A babelnetId drawn but not used (e.g. its lemma lookup failed) is released, back in the not drawn part.
+    """
+    def __init__(self, store, random_source=random):
+        self.store = store
+        self.random = random_source
+        self.pools = {}  # domain - array of the babelnetIds codes
+        self.not_drawn = {}  # domain - number of babelnetIds not drawn yet, they are at the beginning of the array
+        self.lock = threading.Lock()
+
+    def _pool(self, domain):
+        if domain not in self.pools:
+            self.pools[domain] = np.array(self.store.ids_in_domain(domain))  # writable copy
+            self.not_drawn[domain] = len(self.pools[domain])
+        return self.pools[domain]
+
+    def draw(self, domain):
+        """ draws a babelnetId of the domain, None if all the babelnetIds of the domain have been drawn """
+        with self.lock:
+            pool = self._pool(domain)
+            last = self.not_drawn[domain] - 1
+            if last < 0:
+                return None
+            chosen = self.random.randint(0, last)
+            pool[chosen], pool[last] = pool[last], pool[chosen]
+            self.not_drawn[domain] = last
+            return self.store.decode(pool[last])
+
+    def release(self, domain, id):
+        """ puts a drawn babelnetId back among the ones not drawn yet, returns False if it was not drawn """
+        code = self.store.encode(id)
+        with self.lock:
+            pool = self._pool(domain)
+            start = self.not_drawn[domain]
+            drawn = np.flatnonzero(pool[start:] == code) if code is not None else []
+            if len(drawn) == 0:
+                return False
+            position = start + int(drawn[0])
+            pool[position], pool[start] = pool[start], pool[position]
+            self.not_drawn[domain] = start + 1
+            return True
+
+    def remaining(self, domain):
+        """ number of babelnetIds of the domain not drawn yet """
+        with self.lock:
+            self._pool(domain)
+            return self.not_drawn[domain]
+
+
+def load_domain_store(text_file=TEXT_DOMAIN_FILE, domain_file=DOMAIN_FILE):
+    """ Opens the domain store, building it first if it is missing or older than the text file """
+    if not os.path.exists(domain_file) or (
+                os.path.exists(text_file) and os.path.getmtime(domain_file) < os.path.getmtime(text_file)):
+        print('\t\tbuilding', domain_file, '...')
+        build_domain_store(text_file, domain_file)
+    return DomainStore(domain_file)
+
+
+def main():
+    print('Number of babelnetIds stored:', build_domain_store())
+
+if __name__ == '__main__':
+    main()
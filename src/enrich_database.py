@@ -5,18 +5,21 @@ NLP final project
 enrich_database.py
 manages the requests of updating of the dataset with the user answers
 and practically updates the KBS server when executed standalone.
+The entries are written in the enriching database through the journal (journal.py).
 '''
 
 
 import json
-import requests
+import http_client
 from entity_finder import get_entities_ids
+from journal import get_journal, drain, strip_journal_fields
 
 
-def enrich_database(query, answer, domain, relation, c1):
+def enrich_database(query, answer, domain, relation, c1, on_enriched=None):
     """ Enrich the database with the provided data
 
-    If the user answer is useful all the elements of the question are saved on a file in a convenient json format.
+    If the user answer is useful all the elements of the question are saved on a file in a convenient json format,
+    the function returns when the entry is written on disk.
     All the data is provided in input except the entity (babelnetId) in the user answer, that is processed here.
 
     Parameters:
@@ -25,67 +28,95 @@ def enrich_database(query, answer, domain, relation, c1):
         domain - chosen domain
         relation - chosen relation
         c1 - babelnetId of the entity in the query
+        on_enriched - function called with the new entry after it is saved (e.g. Answerer.on_enriched)
 
     Returns:
         True if the dataset is enriched, False if not
     """
+    c2 = answer_entity(answer)
+    if c2 is None:
+        return False
+    data = save_entry(query, answer, domain, relation, c1, c2)
+    if on_enriched:
+        on_enriched(data)
+    return True
+
+
+def answer_entity(answer):
+    """ Finds the entity of a user answer, the network errors are raised so the caller can retry
+
+    Parameters:
+        answer - user answer
+
+    Returns:
+        the babelnetId of the entity, None if the answer is not useful or no entity is detected
+    """
     print('\t\tUser answer:', answer)
     if answer in ['Question is misplaced', 'Sorry, I have not an answer for this question']:
-        return False
-    else:
-        with open('../data/enriching_database.txt', 'a') as f:
-            data = {}
-            try:
-                entities_detected = get_entities_ids(answer, spacy_dis=True)
-                print('\t\tEntities detected:', entities_detected)
-                c2 = list(entities_detected.keys())[0]  # if more entities are detected, the first is chosen
-                print("\tSUCCESS: database enriched")
-            except IndexError:
-                print('FAIL: Database not enriched, Entity in the answer not detected\n')
-                return False
-            data["question"] = query
-            data["answer"] = answer
-            data["relation"] = relation
-            data["context"] = "enriching"
-            data["domains"] = domain
-            data["c1"] = c1
-            data["c2"] = c2
-            f.write(json.dumps(data))
-            f.write('\n')
-            print('\t\t', data, '\n')
-        return True
+        return None
+    entities_detected = get_entities_ids(answer, spacy_dis=True)
+    print('\t\tEntities detected:', entities_detected)
+    if not entities_detected:
+        print('FAIL: Database not enriched, Entity in the answer not detected\n')
+        return None
+    return list(entities_detected.keys())[0]  # if more entities are detected, the first is chosen
+
+
+def save_entry(query, answer, domain, relation, c1, c2):
+    """ Writes an entry in the enriching database, returns the entry when it is written on disk
+
+    Parameters:
+        query - input query
+        answer - user answer
+        domain - chosen domain
+        relation - chosen relation
+        c1 - babelnetId of the entity in the query
+        c2 - babelnetId of the entity in the answer
+
+    Returns:
+        data - the entry, a dict in the format of the enriching database
+    """
+    data = {}
+    data["question"] = query
+    data["answer"] = answer
+    data["relation"] = relation
+    data["context"] = "enriching"
+    data["domains"] = domain
+    data["c1"] = c1
+    data["c2"] = c2
+    get_journal().append(data, wait=True)
+    print("\tSUCCESS: database enriched")
+    print('\t\t', data, '\n')
+    return data
 
 
 def main():
     """ Send new data to the KBS server
 
     If there is something to add to the KBS (the raw_data_file is not empty),
-    all the data is saved in a new json file (json_data_file) that will correspond to the KBS update,
-    the data is uploaded in the KBS,
-    all the data in the raw_data_file is finally erased.
+    all the data, without the journal fields, is saved in a new json file (json_data_file)
+    that will correspond to the KBS update, the data is uploaded in the KBS,
+    if the upload succeeds all the data in the raw_data_file is finally erased.
+    The raw_data_file is locked meanwhile, the entries written by the bot wait and are not lost.
     """
     raw_data_file = '../data/enriching_database.txt'
     json_data_file = '../data/enriching_database.json'
-    with open(raw_data_file, 'r', encoding="utf8") as raw_data:
-        lines = raw_data.readlines()
-    if lines:
+
+    def upload(records):
+        parsed_data = [strip_journal_fields(record) for record in records]
         with open(json_data_file, 'w', encoding="utf8") as raw_to_json_data:
-            raw_to_json_data.write('[')
-            raw_to_json_data.write(lines[0])
-            for i_line in range(1, len(lines)):
-                raw_to_json_data.write(',' + lines[i_line])
-            raw_to_json_data.write(']')
-        with open(json_data_file, 'r', encoding="utf8") as json_data:
-            parsed_data = json.load(json_data)
-            r = requests.post(
-                'http://151.100.179.26:8080/KnowledgeBaseServer/rest-api/add_items_test?key=INSERT-BABELNET-KEY',
-                json=parsed_data)
-            if r.text == '1':
-                print("KBS enriched successfully")
-            else:
-                print("Error:\n", r.text)
-        with open(raw_data_file, 'w', encoding="utf8"):
-            pass
+            json.dump(parsed_data, raw_to_json_data)
+        r = http_client.post(
+            'http://151.100.179.26:8080/KnowledgeBaseServer/rest-api/add_items_test?key=INSERT-BABELNET-KEY',
+            json=parsed_data)
+        if r.text == '1':
+            print("KBS enriched successfully")
+            return True
+        else:
+            print("Error:\n", r.text)
+            return False
+
+    drain(upload, raw_data_file)
 
 
 if __name__ == '__main__':
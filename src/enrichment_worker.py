@@ -0,0 +1,149 @@
+'''
+Author: Antonio Norelli
+NLP final project
+
+enrichment_worker.py
+Processes the user answers of the enriching modality in background.
+The entity of an answer is found with spaCy and Babelnet lookups (enrich_database), too slow for the chat reply:
+the raw answer is recorded in enriching_answers.txt and acknowledged immediately,
+then a pool of worker threads, once the model is ready, finds the entity and saves the entry in the enriching database.
+Only the entity lookup is retried on errors: once the entry is saved the job is enriched,
+and the model is told about it (on_enriched) without affecting the job.
+Each job has a status (pending, enriched, rejected when the answer is not useful, failed after MAX_ATTEMPTS errors),
+the final status is recorded too, so the jobs still pending when the bot stopped are processed at the next start.
+The finished jobs are kept in memory only for the last FINISHED_KEPT ones, the counters count all of them.
+'''
+
+
+import collections
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from columnar_file import replaced_atomically
+from enrich_database import answer_entity, save_entry
+
+ANSWERS_FILE = '../data/enriching_answers.txt'
+WORKERS = 2  # answers processed concurrently
+MAX_ATTEMPTS = 3  # the entity lookup of a job raising errors is retried up to this number of times
+FINISHED_KEPT = 1000  # finished jobs whose status is still available
+
+
+class EnrichmentWorker():
+    """ Background pool processing the enriching answers """
+    def __init__(self, on_enriched=None, wait_ready=None, workers=WORKERS, answers_file=ANSWERS_FILE):
+        self.on_enriched = on_enriched  # function called with each new entry (e.g. Answerer.on_enriched)
+        self.wait_ready = wait_ready  # function waiting for the model, False if it will never be ready (Answerer)
+        self.answers_file = answers_file
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.jobs = {}  # job id - dict with the answer, the status and the attempts, of the pending jobs
+        self.finished = collections.OrderedDict()  # job id - final status, of the last FINISHED_KEPT jobs
+        self.counts = collections.Counter()  # status - number of jobs
+        self.lock = threading.Lock()
+        for job_id, job in self.recover().items():
+            self._start(job_id, job)
+
+    def recover(self):
+        """ returns the jobs recorded without a final status, the answers file is rewritten with them only """
+        jobs = collections.OrderedDict()
+        if os.path.exists(self.answers_file):
+            with open(self.answers_file, 'r', encoding="utf8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:  # incomplete line
+                        continue
+                    if "status" in record:
+                        jobs.pop(record["job"], None)
+                    else:
+                        jobs[record.pop("job")] = record
+        with replaced_atomically(self.answers_file) as temporary_path, open(temporary_path, 'w', encoding="utf8") as f:
+            for job_id, job in jobs.items():
+                f.write(json.dumps(dict(job, job=job_id)) + '\n')
+        if jobs:
+            print('\t\t', len(jobs), 'enriching answers recovered')
+        return jobs
+
+    def _record(self, record):
+        with open(self.answers_file, 'a', encoding="utf8") as f:
+            f.write(json.dumps(record) + '\n')
+
+    def submit(self, query, answer, domain, relation, c1):
+        """ Records an enriching answer and schedules its processing
+
+        Parameters:
+            query - bot question
+            answer - user answer
+            domain - chosen domain
+            relation - relation of the question
+            c1 - babelnetId of the entity in the question
+
+        Returns:
+            the id of the job
+        """
+        job_id = uuid.uuid4().hex
+        job = {"query": query, "answer": answer, "domain": domain, "relation": relation, "c1": c1}
+        with self.lock:
+            self._record(dict(job, job=job_id))
+        self._start(job_id, job)
+        return job_id
+
+    def _start(self, job_id, job):
+        with self.lock:
+            self.jobs[job_id] = {"job": job, "status": 'pending', "attempts": 0}
+            self.counts['pending'] += 1
+        self.executor.submit(self._run, job_id)
+
+    def _run(self, job_id):
+        if self.wait_ready is not None and not self.wait_ready():  # left pending, recovered at the next start
+            return
+        with self.lock:
+            state = self.jobs[job_id]
+            state["attempts"] += 1
+        job = state["job"]
+        try:
+            c2 = answer_entity(job["answer"])
+        except Exception as e:  # catch exception to keep the worker running
+            print(e)
+            if state["attempts"] < MAX_ATTEMPTS:
+                self.executor.submit(self._run, job_id)
+                return
+            self._finish(job_id, 'failed')
+            return
+        if c2 is None:
+            self._finish(job_id, 'rejected')
+            return
+        try:
+            entry = save_entry(job["query"], job["answer"], job["domain"], job["relation"], job["c1"], c2)
+        except Exception as e:  # not retried, the entry could be already written
+            print(e)
+            self._finish(job_id, 'failed')
+            return
+        self._finish(job_id, 'enriched')
+        if self.on_enriched:
+            try:
+                self.on_enriched(entry)
+            except Exception as e:  # the entry is saved, the model learns it at the next start
+                print(e)
+
+    def _finish(self, job_id, status):
+        with self.lock:
+            del self.jobs[job_id]
+            self.finished[job_id] = status
+            while len(self.finished) > FINISHED_KEPT:
+                self.finished.popitem(last=False)
+            self.counts['pending'] -= 1
+            self.counts[status] += 1
+            self._record({"job": job_id, "status": status})
+
+    def status(self, job_id):
+        """ status of a job: pending, enriched, rejected or failed; None if the job is unknown or too old """
+        with self.lock:
+            state = self.jobs.get(job_id)
+            return state["status"] if state else self.finished.get(job_id)
+
+    def stats(self):
+        """ returns a dict with the number of jobs for each status """
+        with self.lock:
+            return dict(self.counts)
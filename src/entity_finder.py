@@ -10,40 +10,188 @@ To find the entities are implemented two different strategies:
     Generally better performance, faster and cheaper in babelcoins, but has some patologies (e.g. long questions with several entities)
     2. spacy_disambiguation, manually finds the entities considering the  POS tags and  the dependency grammar tags.
     Slower and more expensive in babelcoins but better on TIME, PLACE, PART and COLOR questions
+All the API responses go through a persistent cache (api_cache.py), so a call is repeated only when it is expired.
+A synset is fetched once and all its useful fields (main sense, domains, senses) are kept in a SynsetRecord,
+get_synsets fetches several synsets concurrently.
+With SPECULATIVE_DISAMBIGUATION the two strategies run together, the preferred one still wins when it finds something.
+It is off by default: the other strategy is often started for nothing, spending API calls and needing spaCy.
+If a gazetteer (gazetteer.py) is given, the entities known by the knowledge base are looked up in it first, offline,
+and the network is not used if it finds an entity of the domain.
 
 If the code is executed standalone, it is provided an example of usage of the functions
 '''
 
 
-from requests import get
+from http_client import get  # pooled client with timeouts and retries
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import urllib.parse
 import urllib.request
-import spacy  # spaCy is a library for advanced natural language processing in Python and Cython. https://spacy.io/docs/usage/
+from api_cache import get_shared_cache
+from spacy_provider import get_nlp
 
+BABELNET_KEY = "INSERT-BABELNET-KEY"  # babelnet key, used for Babelnet and Babelfy
+SYNSET_WORKERS = 8  # maximum number of concurrent getSynset calls
+CHUNK_WORKERS = 4  # maximum number of chunks of a text resolved concurrently
+CONCURRENT_LOOKUPS = True  # babelnetIds of lemmas and chunks are looked up concurrently
+SPECULATIVE_DISAMBIGUATION = False  # babelfy and spacy disambiguations run concurrently, faster but more API calls
+DISAMBIGUATION_WORKERS = 8  # two per text disambiguated speculatively
+synset_executor = ThreadPoolExecutor(max_workers=SYNSET_WORKERS)
+chunk_executor = ThreadPoolExecutor(max_workers=CHUNK_WORKERS)  # separated, chunk lookups wait for synset lookups
+disambiguation_executor = ThreadPoolExecutor(max_workers=DISAMBIGUATION_WORKERS)  # spacy waits for chunk lookups
 
-def get_entities_ids(text, domain=None, spacy_model=None, spacy_dis=False):
+# main_sense and domains are None if the synset has not them (or the babelnetId is wrong)
+SynsetRecord = namedtuple('SynsetRecord', ['id', 'main_sense', 'domains', 'senses', 'error'])
+
+
+def api_json(endpoint, params):
+    """ Calls a Babelnet or Babelfy API, looking first in the response cache
+
+    Empty responses are cached as negative entries, error messages (e.g. daily limit reached) are not cached.
+
+    Parameters:
+        endpoint - url of the API without parameters
+        params - dict of the parameters of the call, already url encoded, without the key
+
+    Returns:
+        the json response of the API
+    """
+    cache = get_shared_cache()
+    found, json_response = cache.get(endpoint, params)
+    if found:
+        return json_response
+    url = endpoint + "?" + "&".join(name + "=" + value for name, value in params.items()) + "&key=" + BABELNET_KEY
+    json_response = get(url).json()
+    if api_error(json_response) is None:
+        cache.put(endpoint, params, json_response, negative=not json_response)
+    return json_response
+
+
+def api_error(json_response):
+    """ returns the error message of an API response (e.g. daily limit reached), None if it is not an error """
+    if isinstance(json_response, dict) and list(json_response.keys()) == ["message"]:
+        return json_response["message"]
+    return None
+
+
+def gazetteer_entities(gazetteer, text, domain=None, in_domain=None):
+    """ Finds the entities of a text in the gazetteer
+
+    Parameters:
+        gazetteer - Gazetteer of the entities of the knowledge base
+        text - input text in which we want to find the entities
+        domain - domain of interest
+        in_domain - function (babelnetId, domain) -> True if the babelnetId belongs to the domain (DomainStore.contains)
+
+    Returns:
+        entities_id - Dictionary of the finded entities, only the ones of the domain if domain and in_domain are given
+    """
+    entities_id = gazetteer.find(text)
+    if domain and in_domain is not None:
+        entities_id = {id: span for id, span in entities_id.items() if in_domain(id, domain)}
+    return entities_id
+
+
+def get_entities_ids(text, domain=None, spacy_model=None, spacy_dis=False, spacy_doc=None,
+                     speculative=SPECULATIVE_DISAMBIGUATION, gazetteer=None, in_domain=None):
     """ Broker of the entity_finder functions
 
     Broker of the entity_finder functions, calls the appropriate entity finder according to the
-    spacy_dis parameter
+    spacy_dis parameter, the other one is used if the first finds nothing.
+    If a gazetteer is given it is tried first, the network is used only when it finds nothing in the domain
+    (the surface form of a different sense, e.g. "banana" in another domain, is not enough).
+    In speculative mode both are started together, so when the preferred one finds nothing
+    the result of the other is already (or almost) available.
 
     Parameters:
         text - input text in which we want to find the entities
         domain - domain of interest, used to discard unrelated entities
         spacy_model - sapCy English NLP model for spacy_disambiguation
         spacy_dis - it explains itself
+        spacy_doc - text already parsed by spaCy (e.g. with spacy_provider.parse_many), it is parsed here if not given
+        speculative - runs the two entity finders concurrently
+        gazetteer - Gazetteer of the entities of the knowledge base
+        in_domain - function (babelnetId, domain) -> True if the babelnetId belongs to the domain, filters the gazetteer
 
     Returns:
         entities_id - Dictionary of the finded entities in the format {'bn:00000000x': 'Trigger text'}
     """
+    if gazetteer is not None:
+        entities_id = gazetteer_entities(gazetteer, text, domain, in_domain)
+        if entities_id:
+            return entities_id
+    if speculative:
+        return speculative_disambiguation(text, domain, spacy_model, spacy_dis, spacy_doc)
     if spacy_dis:
-        entities_id = spacy_disambiguaton(text, domain=domain, model=spacy_model)
+        entities_id = spacy_disambiguaton(text, domain=domain, model=spacy_model, doc=spacy_doc)
         if not entities_id:
             entities_id = babelfy_disambiguation(text)
     else:
         entities_id = babelfy_disambiguation(text)
         if not entities_id:
-            entities_id = spacy_disambiguaton(text, domain=domain, model=spacy_model)
+            entities_id = spacy_disambiguaton(text, domain=domain, model=spacy_model, doc=spacy_doc)
+    return entities_id
+
+
+def speculative_disambiguation(text, domain, spacy_model, spacy_dis, spacy_doc):
+    """ Runs babelfy_disambiguation and spacy_disambiguaton concurrently
+
+    The result of the preferred entity finder (according to spacy_dis) is returned as soon as it is not empty,
+    then the other one is cancelled: if not started it never runs, spacy stops looking up its remaining chunks.
+    If the preferred entity finder finds nothing the result of the other one is returned.
+    Same parameters and return value of get_entities_ids.
+    """
+    cancel = threading.Event()
+    babelfy_future = disambiguation_executor.submit(babelfy_disambiguation, text)
+    spacy_future = disambiguation_executor.submit(spacy_disambiguaton, text, domain=domain, model=spacy_model,
+                                                  doc=spacy_doc, cancel=cancel)
+    preferred, other = (spacy_future, babelfy_future) if spacy_dis else (babelfy_future, spacy_future)
+    try:
+        entities_id = preferred.result()
+    except Exception:
+        cancel.set()
+        other.cancel()
+        raise
+    if entities_id:
+        cancel.set()
+        other.cancel()
+        return entities_id
+    return other.result()
+
+
+def span_entities_ids(spans, domain=None, gazetteer=None, in_domain=None):
+    """ Finds the entities of the text in place of X and Y in a query pattern (templates.py)
+
+    Each span is an entity: it is looked up in the gazetteer, if given, and if no entity of the domain is found
+    its babelnetId is found using the Babelnet API, without articles "a", "an" and "the".
+    The spans are looked up concurrently.
+
+    Parameters:
+        spans - list of texts, each one containing an entity
+        domain - domain of interest
+        gazetteer - Gazetteer of the entities of the knowledge base
+        in_domain - function (babelnetId, domain) -> True if the babelnetId belongs to the domain, filters the gazetteer
+
+    Returns:
+        entities_id - Dictionary of the finded entities in the format {'bn:00000000x': 'Trigger text'}
+    """
+    def lookup(span):
+        if gazetteer is not None:
+            entities_id = gazetteer_entities(gazetteer, span, domain, in_domain)
+            if entities_id:
+                return entities_id
+        lemma = ' '.join(word for word in span.split() if word.lower() not in ['the', 'a', 'an'])
+        babelnet_id = lemma_to_babelnetid(lemma, domain=domain) if lemma else ''
+        return {babelnet_id: span} if babelnet_id else {}
+
+    if CONCURRENT_LOOKUPS:
+        span_ids = chunk_executor.map(lookup, spans)
+    else:
+        span_ids = [lookup(span) for span in spans]
+    entities_id = {}
+    for ids in span_ids:  # in the order of the spans
+        entities_id.update(ids)
     return entities_id
 
 
@@ -60,14 +208,9 @@ def babelfy_disambiguation(text):
         entities_id - Dictionary of the finded entities in the format {'bn:00000000x': 'Trigger text'}
     """
     text = urllib.parse.quote_plus(text)
-    response = get("https://babelfy.io/v1/disambiguate?"
-                    "text={" + text + "}&"
-                    "lang=EN&"
-                    "matching=PARTIAL_MATCHING&"
-                    "key=INSERT-BABELNET-KEY"
-                   )
+    json_response = api_json("https://babelfy.io/v1/disambiguate",
+                             {"text": "{" + text + "}", "lang": "EN", "matching": "PARTIAL_MATCHING"})
     text = urllib.request.unquote(text)
-    json_response = response.json()
     entities_id = {}
     previous_entity_end, previous_entity_size, previous_entity_id = 0, 0, None
     for entity in json_response:
@@ -86,7 +229,7 @@ def babelfy_disambiguation(text):
     return entities_id
 
 
-def spacy_disambiguaton(text, domain=None, model=None):
+def spacy_disambiguaton(text, domain=None, model=None, doc=None, cancel=None):
     """ Function that manually finds the entities in a text using NLP techniques with spaCy
 
     Candidates for the relevant entities in a query are objects and subjects,
@@ -94,46 +237,85 @@ def spacy_disambiguaton(text, domain=None, model=None):
     (e.g. What can be considered similar to X?, "What" is subject).
     Since spaCy analyzes only the single word, in order to find the complete entity
     is considered the full subtree containing the object/subject without articles "a", "an" and "the".
-    The babelnetId of each entity is found using the Babelnet API.
+    The babelnetId of each entity is found using the Babelnet API, the entities are looked up concurrently.
 
     Parameters:
         text - input text in which we want to find the entities
+        model - spaCy English NLP model, the shared one of spacy_provider if not given
+        doc - text already parsed by spaCy, model is not used if given
+        cancel - threading.Event, when it is set the chunks not looked up yet are skipped (the result is not needed)
 
     Returns:
         entities_id - Dictionary of the finded entities in the format {'bn:00000000x': 'Trigger text'}
     """
-    if not model:
-        print('\t\tloading model...')  # english nlp spacy model used for syntactic dependency parsing
-        model = spacy.load('en')
-        print('\t\tmodel loaded')
-    analysis = model(text)
-    entities_id = {}
+    if cancel is not None and cancel.is_set():
+        return {}
+    if doc is not None:
+        analysis = doc
+    else:
+        analysis = (model or get_nlp())(text)
+    chunks = []
     for word in analysis:
-        if word.dep_[1:5] == 'subj' and word.pos_ in ['NOUN', 'NUM', 'PROPN']:
-            chunk = ''
-            for word1 in word.subtree:
-                if word1.text not in ['the', 'a', 'an']:
-                    chunk += word1.text + ' '
-            chunk = chunk[:-1]  # removing last space
-            babelnet_id = lemma_to_babelnetid(chunk, domain=domain)
-            if babelnet_id:
-                entities_id[babelnet_id] = chunk
-        if word.dep_[1:4] == 'obj':
+        if (word.dep_[1:5] == 'subj' and word.pos_ in ['NOUN', 'NUM', 'PROPN']) or word.dep_[1:4] == 'obj':
             chunk = ''
             for word1 in word.subtree:
                 if word1.text not in ['the', 'a', 'an']:
                     chunk += word1.text + ' '
-            chunk = chunk[:-1]  # removing last space
-            babelnet_id = lemma_to_babelnetid(chunk, domain=domain)
-            if babelnet_id:
-                entities_id[babelnet_id] = chunk
+            chunks.append(chunk[:-1])  # removing last space
+    def lookup(chunk):
+        if cancel is not None and cancel.is_set():
+            return None
+        return lemma_to_babelnetid(chunk, domain=domain, cancel=cancel)
+
+    if CONCURRENT_LOOKUPS:
+        babelnet_ids = chunk_executor.map(lookup, chunks)
+    else:
+        babelnet_ids = [lookup(chunk) for chunk in chunks]
+    entities_id = {}
+    for chunk, babelnet_id in zip(chunks, babelnet_ids):  # in the order of the text, as found sequentially
+        if babelnet_id:
+            entities_id[babelnet_id] = chunk
     return entities_id
 
+def get_synset(id):
+    """ takes a babelnetId, returns its synset record
+
+    Babelnet getSynset API is used, the fields used by the bot are kept
+
+    Parameters:
+        id - babelnetId of the synset
+
+    Returns:
+        a SynsetRecord with the mainSense, the domains and the senses of the synset,
+        if Babelnet answered with an error its message is in the "error" field and the other fields are empty
+    """
+    json_response = api_json("https://babelnet.io/v4/getSynset", {"id": id})
+    error = api_error(json_response)
+    if error is not None or not isinstance(json_response, dict):
+        return SynsetRecord(id, None, None, [], error or 'unexpected response')
+    return SynsetRecord(id, json_response.get("mainSense"), json_response.get("domains"),
+                        json_response.get("senses", []), None)
+
+
+def get_synsets(ids):
+    """ takes a list of babelnetIds, returns their synset records
+
+    Duplicated babelnetIds are fetched only once, different babelnetIds are fetched concurrently
+
+    Parameters:
+        ids - list of babelnetIds
+
+    Returns:
+        a dict {babelnetId: SynsetRecord}
+    """
+    unique_ids = list(dict.fromkeys(ids))
+    return dict(zip(unique_ids, synset_executor.map(get_synset, unique_ids)))
+
 
 def babelnetid_to_lemma(id):
     """ takes a babelnetId, returns the corresponding lemma
 
-    Babelnet getSynset API is used, it returns the "mainSense" of the babelnetId
+    The synset record is used, it returns the "mainSense" of the babelnetId
 
     Parameters:
         id - babelnetId of which we want the lemma
@@ -141,20 +323,14 @@ def babelnetid_to_lemma(id):
     Returns:
         the lemma in a string
     """
-    response = get("https://babelnet.io/v4/getSynset?"
-                   "id=" + id + "&"
-                    "key=INSERT-BABELNET-KEY"
-                   )
-    try:
-        return response.json()["mainSense"]
-    except KeyError:
-        return ''
+    main_sense = get_synset(id).main_sense
+    return main_sense if main_sense is not None else ''
 
 
 def check_id_domain(id, domain):
     """ checks if a babelnetId belongs to a domain
 
-    Babelnet getSynset API is used, it checks if domain is in the "domains" of the babelnetId
+    The synset record is used, it checks if domain is in the "domains" of the babelnetId
 
     Parameters:
         id - babelnetId of which we want the lemma
@@ -163,50 +339,82 @@ def check_id_domain(id, domain):
     Returns:
         True if true, False if false, pretty straightforward
     """
-    response = get("https://babelnet.io/v4/getSynset?"
-                    "id=" + id + "&"
-                    "key=INSERT-BABELNET-KEY"
-                   )
-    json_response = response.json()
-    try:
-        if domain.upper() in json_response["domains"]:
-            return True
-        else:
-            return False
-    except KeyError:
+    domains = get_synset(id).domains
+    if domains is None:
         print('babelnet_id', id, 'does not belong to', domain)
         return False
+    return domain.upper() in domains
 
 
-def lemma_to_babelnetid(lemma, domain=None):
+def lemma_to_babelnetid(lemma, domain=None, concurrent=CONCURRENT_LOOKUPS, cancel=None):
     """ takes a lemma, returns the corresponding babelnetId
 
-        Babelnet getSenses API is used, it returns the "id" of the first "synsetID"
+        Babelnet getSenses API is used, it returns the "id" of the first "synsetID",
+        if a domain is given, of the first "synsetID" that belongs to the domain.
+        In concurrent mode the domains of the candidate synsets are checked in parallel.
 
         Parameters:
-            id - babelnetId of which we want the lemma
+            lemma - lemma of which we want the babelnetId
+            domain - domain of interest
+            concurrent - if True the candidate synsets are checked in parallel
+            cancel - threading.Event, when it is set the candidate synsets not checked yet are skipped
 
         Returns:
-            the lemma in a string
+            the babelnetId in a string
         """
-    response = get("https://babelnet.io/v4/getSenses?"
-                   "word=" + lemma + "&"
-                    "lang=EN&"
-                    "pos=NOUN&"
-                    "key=INSERT-BABELNET-KEY"
-                   )
-    json_response = response.json()
+    json_response = api_json("https://babelnet.io/v4/getSenses", {"word": lemma, "lang": "EN", "pos": "NOUN"})
     try:
-        if domain:
-            for item in json_response:
-                id = item["synsetID"]["id"]  # Possible KeyError or TypeError
-                if check_id_domain(id, domain):
-                    return id
-            return ''
-        else:
-            return response.json()[0]["synsetID"]["id"]  # Possible IndexError
+        if not domain:
+            return json_response[0]["synsetID"]["id"]  # Possible IndexError
+        candidate_ids = []  # several senses can belong to the same synset, each synset is checked once
+        for item in json_response:
+            try:
+                id = item["synsetID"]["id"]
+            except (KeyError, TypeError):  # malformed sense, it and the following ones are not considered
+                break
+            if id not in candidate_ids:
+                candidate_ids.append(id)
     except (KeyError, TypeError, IndexError):
         return ''
+    if concurrent:
+        return first_id_in_domain(candidate_ids, domain, cancel=cancel)
+    for id in candidate_ids:
+        if cancel is not None and cancel.is_set():
+            return ''
+        if check_id_domain(id, domain):
+            return id
+    return ''
+
+
+def first_id_in_domain(ids, domain, cancel=None):
+    """ checks in parallel the domain of a list of babelnetIds, returns the first one belonging to the domain
+
+    The checks are submitted to the bounded synset thread pool, the results are read in the original order,
+    as soon as the first babelnetId of the domain is known the checks not started yet are cancelled.
+    When the cancel event is set (the caller does not need the result) the checks still queued are skipped.
+
+    Parameters:
+        ids - ordered list of babelnetIds
+        domain - domain of interest
+        cancel - threading.Event, the checks starting after it is set do not call Babelnet
+
+    Returns:
+        the first babelnetId belonging to the domain, '' if none belongs to it
+    """
+    def check(id):
+        if cancel is not None and cancel.is_set():
+            return False
+        return check_id_domain(id, domain)
+
+    futures = [synset_executor.submit(check, id) for id in ids]
+    try:
+        for id, future in zip(ids, futures):
+            if future.result():
+                return id
+        return ''
+    finally:
+        for future in futures:
+            future.cancel()
 
 
 def main():  # some examples
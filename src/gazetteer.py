@@ -0,0 +1,145 @@
+'''
+Author: Antonio Norelli
+NLP final project
+
+gazetteer.py
+Offline entity finder built from the knowledge base.
+The entities the bot can answer about are the c1 and c2 of the dataset, and their surface forms are in the questions:
+each question is matched against the query patterns of its relation (templates.py), the most specific pattern first,
+the generic patterns are not used (e.g. "Is X a Y ?" would give "specialization of a dj" as Y),
+the text in place of X is a surface form of c1 and the text in place of Y a surface form of c2.
+The lowercase tokens of the surface forms are stored in a token trie, a surface form shared by different babelnetIds
+is assigned to the most frequent one.
+A text is scanned from left to right taking the longest surface form starting at each token,
+so as in babelfy_disambiguation, if two entities have words in common only the longest one is kept.
+
+The trie is saved in data/gazetteer.pkl and rebuilt when the dataset store or the patterns are newer.
+When executed standalone, it builds the gazetteer and prints the entities found in some example questions.
+'''
+
+
+import collections
+import os
+import pickle
+import re
+from columnar_file import replaced_atomically
+from dataset_store import load_dataset_store, DATASET_FILE
+from templates import TemplateMatcher, PATTERNS_FILE
+GAZETTEER_FILE = '../data/gazetteer.pkl'
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+ARTICLES = ('the', 'a', 'an')
+STOPWORDS = {'what', 'which', 'who', 'where', 'when', 'how', 'is', 'are', 'was', 'were', 'be', 'do', 'does', 'did',
+             'can', 'it', 'its', 'this', 'that', 'there', 'of', 'in', 'on', 'to', 'for', 'and', 'or', 'yes', 'no'}
+MAX_SURFACE_TOKENS = 8  # longer spans come from questions not really matching their pattern
+END = ''  # key of the babelnetId in a trie node, no token is empty
+
+
+def tokens(text):
+    """ lowercase tokens of a text """
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def surface_form(span):
+    """ lowercase tokens of a span without the initial article and punctuation, None if it is not a plausible entity """
+    span_tokens = tokens(span)
+    while span_tokens and (span_tokens[0] in ARTICLES or not span_tokens[0].isalnum()):
+        span_tokens = span_tokens[1:]
+    while span_tokens and not span_tokens[-1].isalnum():
+        span_tokens = span_tokens[:-1]
+    if not span_tokens or len(span_tokens) > MAX_SURFACE_TOKENS or all(token in STOPWORDS or not token.isalnum()
+                                                                       for token in span_tokens):
+        return None
+    return tuple(span_tokens)
+
+
+def build_gazetteer(relation_id, dataset=None, patterns_file=PATTERNS_FILE, gazetteer_file=GAZETTEER_FILE):
+    """ Builds the token trie of the surface forms of the dataset entities and saves it
+
+    Parameters:
+        relation_id - relation - relationId dict
+        dataset - DatasetStore, opened here if not given
+        patterns_file - query patterns
+        gazetteer_file - output file
+
+    Returns:
+        the number of surface forms stored
+    """
+    dataset = dataset if dataset is not None else load_dataset_store()
+    template_matcher = TemplateMatcher(patterns_file)
+    occurrences = collections.defaultdict(collections.Counter)  # surface form - babelnetId counter
+    for entry in dataset:
+        template_match = template_matcher.match(entry["question"], relation=relation_id.get(entry["relation"]),
+                                                generic=False)
+        if template_match:
+            relation, spans = template_match
+            for slot, id in (('X', entry["c1"]), ('Y', entry["c2"])):
+                surface = surface_form(spans[slot]) if slot in spans else None
+                if surface:
+                    occurrences[surface][id] += 1
+    trie = {}
+    for surface, ids in occurrences.items():
+        node = trie
+        for token in surface:
+            node = node.setdefault(token, {})
+        node[END] = ids.most_common(1)[0][0]
+    with replaced_atomically(gazetteer_file) as temporary_path, open(temporary_path, 'wb') as f:
+        pickle.dump(trie, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return len(occurrences)
+
+
+class Gazetteer():
+    """ Longest-match entity finder over the token trie """
+    def __init__(self, gazetteer_file=GAZETTEER_FILE):
+        with open(gazetteer_file, 'rb') as f:
+            self.trie = pickle.load(f)
+
+    def find(self, text):
+        """ Finds the known entities of a text
+
+        Parameters:
+            text - input text in which we want to find the entities
+
+        Returns:
+            entities_id - Dictionary of the finded entities in the format {'bn:00000000x': 'Trigger text'}
+        """
+        matches = list(TOKEN_PATTERN.finditer(text))
+        text_tokens = [match.group().lower() for match in matches]
+        entities_id = {}
+        start = 0
+        while start < len(text_tokens):
+            node, longest = self.trie, None
+            for end in range(start, len(text_tokens)):
+                node = node.get(text_tokens[end])
+                if node is None:
+                    break
+                if END in node:
+                    longest = (end, node[END])
+            if longest is None:
+                start += 1
+                continue
+            end, id = longest
+            entities_id[id] = text[matches[start].start():matches[end].end()]
+            start = end + 1
+        return entities_id
+
+
+def load_gazetteer(relation_id, dataset=None, patterns_file=PATTERNS_FILE, gazetteer_file=GAZETTEER_FILE):
+    """ Opens the gazetteer, building it first if it is missing or older than the dataset store or the patterns """
+    if not os.path.exists(gazetteer_file) or any(
+            os.path.exists(source) and os.path.getmtime(gazetteer_file) < os.path.getmtime(source)
+            for source in (DATASET_FILE, patterns_file)):
+        print('\t\tbuilding', gazetteer_file, '...')
+        build_gazetteer(relation_id, dataset, patterns_file, gazetteer_file)
+    return Gazetteer(gazetteer_file)
+
+
+def main():
+    from Answerer import relation_id_dict
+    print('Number of surface forms stored:', build_gazetteer(relation_id_dict()))
+    gazetteer = Gazetteer()
+    for question in ['Where is Brougham Hall located?', 'Is Chuck Niles a specialization of a DJ ?',
+                     'What is the color of a banana?']:
+        print(question, gazetteer.find(question))
+
+if __name__ == '__main__':
+    main()
@@ -8,8 +8,8 @@ The queries with answer = 'no' are excluded
 '''
 
 
-import urllib.request
 import json
+import http_client
 
 counter = 0
 with open('../dataset.json', 'w') as f:
@@ -19,10 +19,8 @@ with open('../dataset.json', 'w') as f:
             print(id_number)
         url = 'http://151.100.179.26:8080/KnowledgeBaseServer/rest-api/items_from?id=' + str(id_number) + \
               '&key=INSERT-BABELNET-KEY'
-        req = urllib.request.Request(url)
-
         # parsing response
-        r = urllib.request.urlopen(req).read()
+        r = http_client.get(url).content
         cont = json.loads(r.decode('utf-8'))
 
         # parsing json
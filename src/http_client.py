@@ -0,0 +1,136 @@
+'''
+Author: Antonio Norelli
+NLP final project
+
+http_client.py
+Shared HTTP client used for all the outbound calls of the bot (Babelnet, Babelfy, Telegram, knowledge base server).
+    - one requests session, so the connections to each host are pooled and kept alive
+    - connect and read timeouts on every call
+    - bounded retries with jittered exponential backoff on connection errors, 429 and 5xx responses
+      (non idempotent calls, i.e. POST, are retried only when the server refused them: 429 or failed connection)
+    - a limit on the concurrent calls to the same host
+The module functions get and post use a default client configured with the constants below.
+AsyncHttpClient gives the same calls as coroutines for the asyncio runtime of the bot,
+the blocking calls are run in a thread pool, so they keep pooling, timeouts and retries of the default client.
+'''
+
+
+import asyncio
+import functools
+import random
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+
+CONNECT_TIMEOUT = 5  # seconds
+READ_TIMEOUT = 30  # seconds
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5  # seconds, the backoff doubles at each retry
+BACKOFF_MAX = 10  # seconds
+HOST_CONCURRENCY = 8  # maximum number of concurrent calls to the same host
+POOL_SIZE = 16  # kept alive connections for each host
+ASYNC_WORKERS = 16  # threads running the calls of the AsyncHttpClient
+RETRY_STATUS = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}
+
+
+class HttpClient():
+    """ Pooled HTTP client with timeouts, retries and per-host concurrency limits """
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT, max_retries=MAX_RETRIES,
+                 backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX, host_concurrency=HOST_CONCURRENCY,
+                 pool_size=POOL_SIZE):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base, self.backoff_max = backoff_base, backoff_max
+        self.host_concurrency = host_concurrency
+        self.host_semaphores = {}
+        self.lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _semaphore(self, url):
+        host = urllib.parse.urlsplit(url).netloc
+        with self.lock:
+            if host not in self.host_semaphores:
+                self.host_semaphores[host] = threading.BoundedSemaphore(self.host_concurrency)
+            return self.host_semaphores[host]
+
+    def _backoff(self, attempt, response=None):
+        """ seconds to wait before the next attempt, the Retry-After header is respected if present """
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            return min(float(response.headers['Retry-After']), self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))  # full jitter
+
+    def request(self, method, url, timeout=None, **kwargs):
+        """ Makes an HTTP call
+
+        Parameters:
+            method - HTTP method
+            url - url of the call
+            timeout - (connect timeout, read timeout) in seconds, the client ones if not given
+            kwargs - other arguments of requests.Session.request (json, data, headers...)
+
+        Returns:
+            the requests response of the last attempt
+        """
+        method = method.upper()
+        semaphore = self._semaphore(url)
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            try:
+                with semaphore:
+                    response = self.session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                retriable = method in IDEMPOTENT_METHODS or isinstance(e, requests.ConnectTimeout)
+                if last_attempt or not retriable:
+                    raise
+                time.sleep(self._backoff(attempt))
+                continue
+            retriable = response.status_code in RETRY_STATUS and (
+                method in IDEMPOTENT_METHODS or response.status_code == 429)
+            if last_attempt or not retriable:
+                return response
+            delay = self._backoff(attempt, response)
+            response.close()  # the discarded response gives its connection back to the pool
+            time.sleep(delay)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+
+default_client = HttpClient()
+
+
+def get(url, **kwargs):
+    """ GET call with the default client """
+    return default_client.get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    """ POST call with the default client """
+    return default_client.post(url, **kwargs)
+
+
+class AsyncHttpClient():
+    """ asyncio interface of an HttpClient """
+    def __init__(self, client=None, workers=ASYNC_WORKERS):
+        self.client = client or default_client
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    async def request(self, method, url, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(self.client.request, method, url, **kwargs))
+
+    async def get(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request('POST', url, **kwargs)
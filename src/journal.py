@@ -0,0 +1,259 @@
+'''
+Author: Antonio Norelli
+NLP final project
+
+journal.py
+Append-only journal of the enriching database (enriching_database.txt), one json record per line as before.
+The file is kept open and the records are written in groups (group commit): a group is written and synced
+when GROUP_SIZE records are waiting or GROUP_INTERVAL seconds after the first one, whichever comes first.
+Each record gets two more fields:
+    - seq, the sequence number of the record in the file
+    - checksum, the crc32 of the json record without the checksum field
+The writers of the same process are serialized by a lock, the writers of different processes
+by an exclusive lock on the file (fcntl, not available on Windows where only the process lock is used).
+The replay tolerates a torn last line (a crash in the middle of a write), records without seq and checksum
+(written before the journal) are accepted as they are.
+A group whose write fails (e.g. disk full) is dropped, not retried since part of it may be already in the file:
+the writers waiting for its records get an IOError, and the next group checks the end of the file again.
+'''
+
+
+import json
+import os
+import threading
+import time
+import zlib
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+JOURNAL_FILE = '../data/enriching_database.txt'
+GROUP_SIZE = 16  # records written together
+GROUP_INTERVAL = 0.2  # seconds a record can wait before being written
+JOURNAL_FIELDS = ('seq', 'checksum')
+
+
+def checksum(record):
+    """ crc32 of the json record without the checksum field """
+    body = {key: value for key, value in record.items() if key != 'checksum'}
+    return zlib.crc32(json.dumps(body).encode('utf8'))
+
+
+def strip_journal_fields(record):
+    """ the record without seq and checksum, as written before the journal """
+    return {key: value for key, value in record.items() if key not in JOURNAL_FIELDS}
+
+
+def parse_line(line):
+    """ returns the record of a journal line, None if the line is torn or corrupted """
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(record, dict) or ('checksum' in record and record['checksum'] != checksum(record)):
+        return None
+    return record
+
+
+def replay(path=JOURNAL_FILE):
+    """ Reads the valid records of a journal, in order
+
+    Parameters:
+        path - journal file
+
+    Returns:
+        list of the records, torn or corrupted lines are skipped
+    """
+    records, skipped = [], 0
+    if not os.path.exists(path):
+        return records
+    with open(path, 'r', encoding="utf8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = parse_line(line)
+            if record is None:
+                skipped += 1
+            else:
+                records.append(record)
+    if skipped:
+        print('\t\t', skipped, 'torn or corrupted lines skipped in', path)
+    return records
+
+
+def _lock(f):
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+
+def _unlock(f):
+    if fcntl:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class Journal():
+    """ Group-committed append-only writer of json records """
+    def __init__(self, path=JOURNAL_FILE, group_size=GROUP_SIZE, group_interval=GROUP_INTERVAL):
+        self.path = path
+        self.group_size, self.group_interval = group_size, group_interval
+        self.file = open(path, 'a+', encoding="utf8")
+        self.size = -1  # size of the file after the last write of this process, -1 if unknown
+        self.seq = 0  # last sequence number in the file
+        self.pending = []  # records waiting to be written
+        self.committed = 0  # number of records written by this process
+        self.finished = 0  # number of records appended in this process whose group is written or failed
+        self.queued = 0  # number of records appended in this process
+        self.groups, self.failed = 0, 0
+        self.last_error = None
+        self.condition = threading.Condition()
+        self.flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        self.flusher.start()
+
+    def _last_seq(self):
+        """ sequence number of the last record of the file, a torn last line is terminated """
+        self.file.seek(0)
+        last_seq, last_char = 0, '\n'
+        for line in self.file:
+            record = parse_line(line)
+            if record is not None and 'seq' in record:
+                last_seq = record['seq']
+            last_char = line[-1]
+        if last_char != '\n':  # torn last line, the next record must start on a new line
+            self.file.write('\n')
+            self.file.flush()
+        return last_seq
+
+    def append(self, record, wait=False):
+        """ Appends a record to the journal
+
+        Parameters:
+            record - json serializable dict
+            wait - if True returns only when the record is written and synced on disk
+
+        Returns:
+            the sequence number of the record if wait is True, None otherwise
+
+        Raises:
+            IOError if wait is True and the group of the record could not be written
+        """
+        entry = dict(record)
+        with self.condition:
+            self.pending.append(entry)
+            self.queued += 1
+            position = self.queued
+            if len(self.pending) >= self.group_size:
+                self._write_group()
+            else:
+                self.condition.notify_all()  # wakes up the flusher
+            if not wait:
+                return None
+            while self.finished < position:
+                self.condition.wait()
+            if entry['seq'] is None:
+                raise IOError('journal record not written: ' + str(self.last_error))
+            return entry['seq']
+
+    def flush(self):
+        """ writes the pending records now """
+        with self.condition:
+            self._write_group()
+
+    def _write_group(self):  # called holding the condition lock
+        if not self.pending:
+            return
+        group, self.pending = self.pending, []
+        try:
+            _lock(self.file)
+            try:
+                self.file.seek(0, os.SEEK_END)
+                if self.file.tell() != self.size:  # written by another process (or first write), sequence reloaded
+                    self.seq = self._last_seq()
+                lines = []
+                for record in group:
+                    self.seq += 1
+                    record.pop('checksum', None)
+                    record['seq'] = self.seq
+                    record['checksum'] = checksum(record)
+                    lines.append(json.dumps(record) + '\n')
+                self.file.write(''.join(lines))
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.size = self.file.tell()
+            finally:
+                _unlock(self.file)
+        except Exception as e:  # the group is dropped, its writers are told by append
+            for record in group:
+                record['seq'] = None
+            self.size = -1  # the group may be in the file in part, sequence and last line are checked again
+            self.failed += len(group)
+            self.last_error = e
+            print('journal group of', len(group), 'records not written:', e)
+        else:
+            self.committed += len(group)
+            self.groups += 1
+        self.finished += len(group)
+        self.condition.notify_all()
+
+    def _flush_periodically(self):
+        with self.condition:
+            while True:
+                while not self.pending:
+                    self.condition.wait()
+                deadline = time.time() + self.group_interval
+                while self.pending and len(self.pending) < self.group_size and time.time() < deadline:
+                    self.condition.wait(deadline - time.time())
+                try:
+                    self._write_group()
+                except Exception as e:  # catch exception to keep the flusher running
+                    print(e)
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def stats(self):
+        """ returns a dict with the records written, the groups, the pending and the failed records """
+        with self.condition:
+            return {"records": self.committed, "groups": self.groups, "pending": len(self.pending),
+                    "failed": self.failed, "last_seq": self.seq}
+
+
+def drain(consumer, path=JOURNAL_FILE):
+    """ Passes all the records of a journal to a function, the journal is emptied if the function returns True
+
+    The file is locked meanwhile, so the records written by other processes wait and are not lost.
+
+    Parameters:
+        consumer - function called with the list of the records
+        path - journal file
+
+    Returns:
+        the value returned by consumer, None if the journal is empty
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r+', encoding="utf8") as f:
+        _lock(f)
+        try:
+            records = [record for record in (parse_line(line) for line in f if line.strip()) if record is not None]
+            if not records:
+                return None
+            consumed = consumer(records)
+            if consumed:
+                f.truncate(0)
+            return consumed
+        finally:
+            _unlock(f)
+
+
+journals = {}  # path - Journal, one writer per file in a process
+journals_lock = threading.Lock()
+
+
+def get_journal(path=JOURNAL_FILE):
+    """ returns the journal writer of a file, opened the first time it is requested """
+    with journals_lock:
+        if path not in journals:
+            journals[path] = Journal(path)
+        return journals[path]
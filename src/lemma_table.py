@@ -0,0 +1,127 @@
+'''
+Author: Antonio Norelli
+NLP final project
+
+lemma_table.py
+Offline babelnetId - lemma table, in the columnar format (columnar_file.py).
+The babelnetIds are integer encoded and sorted, their lemmas (the main sense of the synset) are in a string heap,
+so a lemma is found with a binary search in the memory-mapped file, without calling Babelnet.
+A babelnetId whose synset has no main sense is stored with an empty lemma, so it is not looked up again,
+while a babelnetId whose lookup failed (Babelnet answered with an error) is left out and retried at the next refresh.
+The table is built in batches of synsets fetched concurrently (get_synsets) and refreshed incrementally:
+only the babelnetIds not in the table yet are looked up, at most MAX_LOOKUPS per run (Babelnet has a daily limit).
+
+When executed standalone, it adds to the table the lemmas of the babelnetIds of the domain store not in it yet.
+'''
+
+
+import os
+import numpy as np
+from columnar_file import write_columns, read_columns, replaced_atomically, StringHeap
+from dataset_store import encode_babelnet_id, decode_babelnet_id, IRREGULAR_ID_BASE
+from entity_finder import get_synsets, get_synset
+from domain_store import load_domain_store
+
+LEMMA_FILE = '../data/lemmas.bin'
+BATCH_SIZE = 200  # synsets fetched concurrently
+CHECKPOINT_BATCHES = 10  # batches between two writes of the table, an interrupted refresh keeps its lemmas
+MAX_LOOKUPS = 1000  # new babelnetIds looked up in a refresh
+
+
+def write_lemma_table(lemmas, lemma_file=LEMMA_FILE):
+    """ Writes a dict {babelnetId integer code: lemma} in the columnar format, written apart and renamed """
+    codes = np.array(sorted(lemmas), dtype='<u4')
+    offsets, heap = StringHeap.build(lemmas[int(code)] for code in codes)
+    with replaced_atomically(lemma_file) as temporary_path:
+        write_columns(temporary_path, {"id": codes, "lemma_offsets": offsets, "lemma_heap": heap})
+
+
+def refresh_lemma_table(ids, lemma_file=LEMMA_FILE, max_lookups=MAX_LOOKUPS):
+    """ Adds to the lemma table the lemmas of the babelnetIds not in it yet
+
+    Parameters:
+        ids - babelnetIds (strings or integer codes) that should be in the table
+        lemma_file - the table, created if missing
+        max_lookups - maximum number of babelnetIds looked up, None for no limit
+
+    Returns:
+        the number of babelnetIds added
+    """
+    table = LemmaTable(lemma_file)
+    lemmas = {int(code): table.lemmas[i] for i, code in enumerate(table.ids)}
+    codes = [encode_babelnet_id(id) if isinstance(id, str) else int(id) for id in ids]
+    missing = list(dict.fromkeys(code for code in codes if code is not None and code not in lemmas))
+    missing = missing[:max_lookups] if max_lookups is not None else missing
+    added = 0
+    for batch_number, start in enumerate(range(0, len(missing), BATCH_SIZE)):
+        batch = [decode_babelnet_id(code) for code in missing[start:start + BATCH_SIZE]]
+        errors = []
+        for id, record in get_synsets(batch).items():
+            if record.error is not None:  # not stored, retried at the next refresh
+                errors.append(record.error)
+                continue
+            lemmas[encode_babelnet_id(id)] = (record.main_sense or '').replace('_', ' ')
+            added += 1
+        if errors:  # usually the daily limit, the next lookups would fail too
+            print('\t\t', len(errors), 'lookups failed, refresh stopped:', errors[0])
+            break
+        if (batch_number + 1) % CHECKPOINT_BATCHES == 0:
+            write_lemma_table(lemmas, lemma_file)
+            print('\t\t', start + len(batch), '/', len(missing), 'lemmas looked up')
+    write_lemma_table(lemmas, lemma_file)
+    return added
+
+
+class LemmaTable():
+    """ Read-only memory-mapped babelnetId - lemma table, empty if the file is missing """
+    def __init__(self, lemma_file=LEMMA_FILE):
+        if os.path.exists(lemma_file):
+            meta, columns = read_columns(lemma_file)
+            self.ids = columns["id"]
+            self.lemmas = StringHeap(columns["lemma_offsets"], columns["lemma_heap"])
+        else:
+            self.ids = np.empty(0, dtype='<u4')
+            self.lemmas = StringHeap(*StringHeap.build([]))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id):
+        return self.get(id) is not None
+
+    def get(self, id):
+        """ lemma of a babelnetId, empty if it has no lemma, None if it is not in the table """
+        code = encode_babelnet_id(id) if isinstance(id, str) else id
+        if code is None:
+            return None
+        i = int(np.searchsorted(self.ids, code))
+        if i < len(self.ids) and self.ids[i] == code:
+            return self.lemmas[i]
+        return None
+
+    def lemma(self, id):
+        """ Lemma of a babelnetId, looked up on Babelnet if it is not in the table
+
+        Parameters:
+            id - babelnetId
+
+        Returns:
+            the lemma, empty if the synset has no main sense, None if the Babelnet lookup failed
+        """
+        lemma = self.get(id)
+        if lemma is None:
+            record = get_synset(id)
+            if record.error is not None:
+                print('\t\tlemma lookup of', id, 'failed:', record.error)
+                return None
+            lemma = (record.main_sense or '').replace('_', ' ')
+        return lemma
+
+
+def main():
+    ids = load_domain_store().ids
+    print('Number of lemmas added:', refresh_lemma_table(ids[ids < IRREGULAR_ID_BASE]))  # irregular ones looked up live
+    print('Number of lemmas stored:', len(LemmaTable()))
+
+if __name__ == '__main__':
+    main()
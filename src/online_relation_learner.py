@@ -0,0 +1,173 @@
+'''
+Author: Antonio Norelli
+NLP final project
+
+online_relation_learner.py
+Relation identifier that keeps learning from the enriching answers, without a full retraining.
+The questions stored in enriching_database.txt come with a confirmed relation, they are good training samples.
+    - the features are hashed unigrams and bigrams (HashingVectorizer), a stable feature space with no vocabulary
+    - the classifier is a linear SVM trained by stochastic gradient descent, updated with partial_fit
+    - an update is tried on a copy of the model and rejected if the accuracy on the held-out query patterns
+      drops more than TOLERANCE below the best accuracy reached
+    - the model is checkpointed every CHECKPOINT_EVERY accepted updates
+It has the same predict and predict_many methods of RelationIdentifier.
+
+When executed standalone, it learns all the entries of enriching_database.txt not learned yet and saves the model.
+'''
+
+
+import copy
+import hashlib
+import os
+import pickle
+import threading
+from columnar_file import replaced_atomically
+from Relation_identifier import dataset_preparation, MODEL_DIR, RANDOM_STATE
+from journal import replay, JOURNAL_FILE
+
+CHECKPOINT_FILE = os.path.join(MODEL_DIR, 'online_relation_learner.pkl')
+HASH_FEATURES = 2 ** 16  # the coefficients are dense, 8 bytes per feature and relation in the checkpoint
+INITIAL_EPOCHS = 20  # passes over the query patterns when the model is created
+BATCH_SIZE = 5  # observed samples are learned in batches of this size
+TOLERANCE = 0.02  # maximum accepted drop of the held-out accuracy
+CHECKPOINT_EVERY = 10  # accepted updates between two checkpoints
+
+
+class OnlineRelationLearner():
+    """ Incrementally trained relation classifier """
+    def __init__(self):
+        from sklearn.linear_model import SGDClassifier
+        X_train, y_train, X_test, y_test = dataset_preparation()
+        self.vectorizer = self.new_vectorizer()
+        self.classes = sorted(set(y_train) | set(y_test))
+        self.held_out = (self.vectorizer.transform(X_test), y_test)
+        self.model = SGDClassifier(loss='hinge', random_state=RANDOM_STATE)
+        X_matrix_tr = self.vectorizer.transform(X_train)
+        for epoch in range(INITIAL_EPOCHS):
+            self.model.partial_fit(X_matrix_tr, y_train, classes=self.classes)
+        self.best_accuracy = self.accuracy(self.model)
+        self.buffer = []  # observed samples not learned yet
+        self.learned = set()  # hashes of the learned samples, each sample is learned once
+        self.accepted, self.rejected = 0, 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def new_vectorizer():
+        from sklearn.feature_extraction.text import HashingVectorizer
+        return HashingVectorizer(ngram_range=(1, 2), lowercase=True, n_features=HASH_FEATURES, alternate_sign=False)
+
+    def __getstate__(self):  # the lock and the vectorizer are not pickled
+        state = self.__dict__.copy()
+        del state["lock"], state["vectorizer"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+        self.vectorizer = self.new_vectorizer()
+
+    def accuracy(self, model):
+        X_test, y_test = self.held_out
+        return model.score(X_test, y_test)
+
+    def predict(self, text):
+        """ returns the id of the predicted relation of a text """
+        return self.predict_many([text])[0]
+
+    def predict_many(self, texts):
+        """ returns the list of the ids of the predicted relations of a list of texts """
+        if not texts:
+            return []
+        return self.model.predict(self.vectorizer.transform(texts)).tolist()
+
+    def observe(self, text, relation):
+        """ Collects a sample, the samples are learned in batches of BATCH_SIZE
+
+        Parameters:
+            text - question
+            relation - confirmed relationId of the question
+
+        Returns:
+            True if the sample completed a batch that has been accepted, False otherwise
+        """
+        key = hashlib.sha1((text + '\t' + str(relation)).encode('utf8')).hexdigest()
+        with self.lock:
+            if relation not in self.classes or key in self.learned:
+                return False
+            self.learned.add(key)
+            self.buffer.append((text, relation))
+            if len(self.buffer) < BATCH_SIZE:
+                return False
+            batch, self.buffer = self.buffer, []
+        return self.update(batch)
+
+    def update(self, samples):
+        """ Learns a batch of samples, if the held-out accuracy does not regress
+
+        Parameters:
+            samples - list of (question, relationId)
+
+        Returns:
+            True if the update is accepted, False if it is rejected
+        """
+        with self.lock:
+            candidate = copy.deepcopy(self.model)
+            candidate.partial_fit(self.vectorizer.transform([text for text, relation in samples]),
+                                  [relation for text, relation in samples])
+            accuracy = self.accuracy(candidate)
+            if accuracy < self.best_accuracy - TOLERANCE:
+                self.rejected += 1
+                print('\t\tonline update rejected, held-out accuracy', accuracy, 'best', self.best_accuracy)
+                return False
+            self.model = candidate  # swapped in one step, predictions never see a half updated model
+            self.best_accuracy = max(self.best_accuracy, accuracy)
+            self.accepted += 1
+            if self.accepted % CHECKPOINT_EVERY == 0:
+                self.save()
+            return True
+
+    def save(self, path=CHECKPOINT_FILE):
+        """ checkpoints the learner, written apart and renamed so a crash never leaves a broken checkpoint """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with replaced_atomically(path) as temporary_path, open(temporary_path, 'wb') as f:
+            pickle.dump(self, f)
+
+
+def load_online_learner(path=CHECKPOINT_FILE):
+    """ Opens the last checkpoint of the learner, a new learner is trained on the query patterns if it is missing """
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            learner = pickle.load(f)
+        if learner.model.coef_.shape[1] == HASH_FEATURES:
+            return learner
+        print('\t\t', path, 'has a different number of features, a new learner is trained')
+    return OnlineRelationLearner()
+
+
+def learn_enriching_database(learner, relation_id, path=JOURNAL_FILE):
+    """ Learns the entries of the enriching database, the ones already learned are skipped
+
+    Parameters:
+        learner - OnlineRelationLearner
+        relation_id - relation - relationId dict
+        path - enriching database, one json entry per line
+
+    Returns:
+        the number of accepted and rejected updates
+    """
+    accepted, rejected = learner.accepted, learner.rejected
+    for entry in replay(path):  # torn or corrupted lines are skipped
+        if entry.get("relation", '').upper() in relation_id:
+            learner.observe(entry["question"], relation_id[entry["relation"].upper()])
+    return learner.accepted - accepted, learner.rejected - rejected
+
+
+def main():
+    from Answerer import relation_id_dict
+    learner = load_online_learner()
+    print('accepted and rejected updates:', learn_enriching_database(learner, relation_id_dict()))
+    print('held-out accuracy:', learner.accuracy(learner.model))
+    learner.save()
+
+if __name__ == '__main__':
+    main()
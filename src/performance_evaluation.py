@@ -7,28 +7,40 @@ Generates the suitable test set and then the scores for the entity finder and th
 '''
 
 
-from Relation_identifier import RelationIdentifier
+from Relation_identifier import RelationIdentifier, PATTERNS_FILE
+from relation_engine import load_relation_engine
 from Answerer import dataset_dicts, relation_id_dict
 import numpy as np
-import matplotlib.pyplot as plt
-from sklearn.metrics import confusion_matrix, classification_report
 import itertools
-from entity_finder import get_entities_ids, babelnetid_to_lemma
-import spacy
+from entity_finder import get_entities_ids
+from lemma_table import LemmaTable
+from spacy_provider import parse_many
 import random
+import time
 
 random.seed(42)
 
-dataset = dataset_dicts()
+# matplotlib and sklearn are imported by the functions using them, spaCy when it is first used (spacy_provider.py),
+# the dataset is loaded by main
+dataset_order = []  # the dataset is memory-mapped, so it is shuffled the order of its entries
+
+
+def ordered(dataset):
+    """ iterates the dataset entries in the current dataset_order, decoding them one at a time """
+    for position in dataset_order:
+        yield dataset[position]
+
 
 def plot_confusion_matrix(cm, classes,
                           normalize=False,
                           title='Confusion matrix',
-                          cmap=plt.cm.Blues):
+                          cmap=None):
     """
     This function prints and plots the confusion matrix.
     Normalization can be applied by setting `normalize=True`.
     """
+    import matplotlib.pyplot as plt
+    cmap = cmap or plt.cm.Blues
     if normalize:
         cm = cm.astype('float') * 100 / cm.sum(axis=1)[:, np.newaxis]
         print("Normalized confusion matrix")
@@ -58,6 +70,8 @@ def plot_confusion_matrix(cm, classes,
 
 
 def evaluation_relation_identifier(dataset):
+    import matplotlib.pyplot as plt
+    from sklearn.metrics import confusion_matrix, classification_report
     rel_id_dict = relation_id_dict()
     id_relation = {v: k for k, v in rel_id_dict.items()}
     relations_occurrences = {k: 100 for k in rel_id_dict.keys()}
@@ -65,7 +79,7 @@ def evaluation_relation_identifier(dataset):
     relation_identifier.training()
 
     test_samples = []
-    for entry in dataset:
+    for entry in ordered(dataset):
         # if entry["answer"].lower() not in ['yes', 'no']:
         relation = entry["relation"]
         if relations_occurrences[relation]:
@@ -76,9 +90,10 @@ def evaluation_relation_identifier(dataset):
     test_samples = list(sorted(test_samples, key=lambda k: k['relation']))
 
     y_true, y_pred = [], []
-    for sample in test_samples:
+    predicted_relations = relation_identifier.predict_many([sample["question"] for sample in test_samples])
+    for sample, predicted_relation in zip(test_samples, predicted_relations):
         y_true.append(sample["relation"])
-        y_pred.append(id_relation[relation_identifier.predict(sample["question"])])
+        y_pred.append(id_relation[predicted_relation])
         last_t = y_true[-1]
         last_p = y_pred[-1]
         if last_p != last_t:
@@ -100,16 +115,39 @@ def evaluation_relation_identifier(dataset):
     plt.show()
 
 
+def evaluation_relation_engine(dataset):
+    """ Equivalence test of the numpy relation engine
+
+    The relations predicted by the numpy engine used by the bot are compared with the ones predicted by the
+    sklearn classifier, on the query patterns and on all the questions of the dataset.
+    The average time of a prediction of the engine is printed.
+    """
+    relation_identifier = RelationIdentifier()
+    relation_identifier.training()
+    relation_engine = load_relation_engine()
+    with open(PATTERNS_FILE, 'r') as f:
+        texts = [line.split('\t')[0] for line in f.readlines()]
+    texts += [entry["question"] for entry in dataset]
+    start = time.time()
+    engine_predictions = relation_engine.predict_many(texts)
+    engine_time = (time.time() - start) / len(texts)
+    sklearn_predictions = relation_identifier.predict_many(texts)
+    differences = 0
+    for text, engine_prediction, sklearn_prediction in zip(texts, engine_predictions, sklearn_predictions):
+        if engine_prediction != sklearn_prediction:
+            differences += 1
+            print(sklearn_prediction, engine_prediction, text)
+    print('different predictions:', differences, '/', len(texts))
+    print('engine time per prediction:', engine_time * 1e6, 'microseconds')
+
+
 def evaluation_entity_identifier(dataset):
-    random.shuffle(dataset)
-    print('\t\tloading model...')  # english nlp spacy model used for syntactic dependency parsing
-    model = spacy.load('en')
-    print('\t\tmodel loaded')
+    random.shuffle(dataset_order)
     rel_id_dict = relation_id_dict()
     relations_occurrences = {k: 5 for k in rel_id_dict.keys()}
 
     test_samples = []
-    for entry in dataset:
+    for entry in ordered(dataset):
         # if entry["answer"].lower() not in ['yes', 'no']:
         relation = entry["relation"]
         if relations_occurrences[relation] and entry["answer"].lower() not in ['yes', 'no']:
@@ -119,11 +157,12 @@ def evaluation_entity_identifier(dataset):
             break
     test_samples = list(sorted(test_samples, key=lambda k: k['relation']))
 
+    spacy_docs = parse_many([sample["question"] for sample in test_samples])  # parsed together, in batches
     total_correct_prediction = 0
     print('score\tbID1\tbID2\tpredicted_entities\tquery')
-    for sample in test_samples:
+    for sample, spacy_doc in zip(test_samples, spacy_docs):
         entities_correspondence = 0
-        predicted_entities = get_entities_ids(sample["question"], spacy_dis=False, spacy_model=model)
+        predicted_entities = get_entities_ids(sample["question"], spacy_dis=False, spacy_doc=spacy_doc)
         if sample["c1"] in predicted_entities or sample["c2"] in predicted_entities:
             entities_correspondence = 1
             total_correct_prediction += 1
@@ -131,15 +170,12 @@ def evaluation_entity_identifier(dataset):
     print('\ntotal score:', total_correct_prediction, '/', len(test_samples), '\t', float(total_correct_prediction*100)/len(test_samples), '%')
 
 def dataset_consistency(dataset):
-    random.shuffle(dataset)
-    print('\t\tloading model...')  # english nlp spacy model used for syntactic dependency parsing
-    model = spacy.load('en')
-    print('\t\tmodel loaded')
+    random.shuffle(dataset_order)
     rel_id_dict = relation_id_dict()
     relations_occurrences = {k: 5 for k in rel_id_dict.keys()}
 
     test_samples = []
-    for entry in dataset:
+    for entry in ordered(dataset):
         # if entry["answer"].lower() not in ['yes', 'no']:
         relation = entry["relation"]
         if relations_occurrences[relation] and entry["answer"].lower() not in ['yes', 'no']:
@@ -149,12 +185,16 @@ def dataset_consistency(dataset):
             break
     test_samples = list(sorted(test_samples, key=lambda k: k['relation']))
 
+    lemmas = LemmaTable()  # Babelnet is called only for the babelnetIds not in the table
     for entry in test_samples:
-        print(entry['relation'], '\t', entry["question"], '\t', babelnetid_to_lemma(entry["c1"]), '\t', babelnetid_to_lemma(entry['c2']))
+        print(entry['relation'], '\t', entry["question"], '\t', lemmas.lemma(entry["c1"]), '\t', lemmas.lemma(entry['c2']))
 
 def main():
+    dataset = dataset_dicts()
+    dataset_order.extend(range(len(dataset)))
     dataset_consistency(dataset)
     evaluation_entity_identifier(dataset)
     evaluation_relation_identifier(dataset)
+    evaluation_relation_engine(dataset)
 if __name__ == '__main__':
     main()
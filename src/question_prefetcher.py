@@ -0,0 +1,102 @@
+'''
+Author: Antonio Norelli
+NLP final project
+
+question_prefetcher.py
+Background producer of the enriching questions.
+Formulating a question (Answerer.query) needs lemma lookups on Babelnet, so for each domain a small buffer of
+questions is kept ready: when a domain buffer goes below the low watermark, a worker thread refills it
+up to the high watermark, while the users are served from the buffer without waiting.
+A buffered question whose answer has been learned in the meantime (by another user or from the knowledge base)
+is stale and it is discarded when it is taken.
+When a buffer is empty the question is formulated on the spot, as without the prefetcher.
+'''
+
+
+import collections
+import threading
+
+LOW_WATERMARK = 2  # a domain buffer is refilled when it has fewer questions than this
+HIGH_WATERMARK = 5  # and it is refilled up to this number of questions
+WORKERS = 2  # threads refilling the buffers
+
+
+class QuestionPrefetcher():
+    """ Per-domain buffers of ready enriching questions, refilled in background """
+    def __init__(self, model, domains, low_watermark=LOW_WATERMARK, high_watermark=HIGH_WATERMARK, workers=WORKERS):
+        self.model = model  # Answerer, the refill starts when it is ready
+        self.low_watermark, self.high_watermark = low_watermark, high_watermark
+        self.buffers = {domain: collections.deque() for domain in domains}
+        self.refill = collections.deque(domains)  # domains to refill, all at the beginning
+        self.scheduled = set(domains)  # domains in refill or being refilled
+        self.hits, self.misses, self.discarded = 0, 0, 0
+        self.condition = threading.Condition()
+        self.threads = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def stale(self, question):
+        return self.model.covered(self.model.relation_id[question["relation"]], question["c1"])
+
+    def take(self, domain):
+        """ Returns a question of a domain, from the buffer if there is one still not answered
+
+        Parameters:
+            domain - chosen domain
+
+        Returns:
+            a dict with the question, its relation and its entity, as Answerer.query
+        """
+        question = None
+        with self.condition:
+            buffer = self.buffers.setdefault(domain, collections.deque())
+            while buffer and question is None:
+                question = buffer.popleft()
+                if self.stale(question):
+                    self.discarded += 1
+                    question = None
+            if len(buffer) < self.low_watermark:
+                self._schedule(domain)
+            if question is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if question is None:  # empty buffer, formulated now
+            question = self.model.query(domain)
+        return question
+
+    def _schedule(self, domain):
+        if domain not in self.scheduled:
+            self.scheduled.add(domain)
+            self.refill.append(domain)
+            self.condition.notify()
+
+    def _work(self):
+        if not self.model.wait_ready():  # setup failed, no question can be formulated
+            return
+        while True:
+            with self.condition:
+                while not self.refill:
+                    self.condition.wait()
+                domain = self.refill.popleft()
+            while True:
+                with self.condition:
+                    if len(self.buffers[domain]) >= self.high_watermark:
+                        self.scheduled.discard(domain)
+                        break
+                try:
+                    question = self.model.query(domain)
+                except Exception as e:  # catch exception to keep the worker running, retried at the next take
+                    print(e)
+                    question = None
+                with self.condition:
+                    if question is None:  # no more questions in the domain (or failure)
+                        self.scheduled.discard(domain)
+                        break
+                    self.buffers[domain].append(question)
+
+    def stats(self):
+        """ returns a dict with the buffered questions and the counters of the prefetcher """
+        with self.condition:
+            return {"buffered": sum(len(buffer) for buffer in self.buffers.values()), "hits": self.hits,
+                    "misses": self.misses, "discarded": self.discarded, "refilling": len(self.scheduled)}
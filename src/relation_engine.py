@@ -0,0 +1,91 @@
+'''
+Author: Antonio Norelli
+NLP final project
+
+relation_engine.py
+Inference-only version of the relation identifier, it needs only numpy.
+Since the kernel of the SVM is linear, the trained classifier is exported as:
+    - the vocabulary of the selected unigrams and bigrams, as a dict n-gram - column
+    - the dense weight matrix and the intercepts of the one-vs-one binary classifiers
+    - the classes of each binary classifier
+A text is tokenized as the sklearn CountVectorizer does, each binary classifier votes for one of its two classes
+and the most voted relation is returned (ties go to the first class, as in libsvm).
+The exported engine is saved in data/models, named after the same hash of the classifier it comes from.
+'''
+
+
+import os
+import re
+import numpy as np
+from columnar_file import replaced_atomically
+from Relation_identifier import MAX_FEATURES, MODEL_DIR, model_hash
+
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")  # default token pattern of CountVectorizer
+
+
+def engine_file():
+    return os.path.join(MODEL_DIR, 'relation_engine_' + model_hash(MAX_FEATURES)[:16] + '.npz')
+
+
+def export_engine(relation_identifier, path=None):
+    """ Exports a trained RelationIdentifier in the numpy format
+
+    Parameters:
+        relation_identifier - trained RelationIdentifier
+        path - output file, engine_file() if not given
+
+    Returns:
+        the path of the exported engine
+    """
+    path = path or engine_file()
+    selector = relation_identifier.model.named_steps['feature_selection']
+    svc = relation_identifier.model.named_steps['clf']
+    terms = np.array(relation_identifier.voc)[selector.get_support()]
+    coef = svc.coef_.toarray() if hasattr(svc.coef_, 'toarray') else np.asarray(svc.coef_)  # sparse if trained on sparse
+    n_classes = len(svc.classes_)
+    pairs = np.array([(i, j) for i in range(n_classes) for j in range(i + 1, n_classes)])  # libsvm order
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with replaced_atomically(path, suffix='.npz') as temporary_path:  # np.savez adds .npz to the other names
+        np.savez(temporary_path, terms=terms, weights=coef.T, intercepts=svc.intercept_, classes=svc.classes_,
+                 pairs=pairs)
+    return path
+
+
+class RelationEngine():
+    """ numpy one-vs-one linear SVM, with the same predict and predict_many methods of RelationIdentifier """
+    def __init__(self, path=None):
+        with np.load(path or engine_file()) as data:
+            self.vocabulary = {term: column for column, term in enumerate(data["terms"].tolist())}
+            self.weights = data["weights"]  # features x binary classifiers
+            self.intercepts = data["intercepts"]
+            self.classes = data["classes"].tolist()
+            self.first_classes, self.second_classes = data["pairs"][:, 0], data["pairs"][:, 1]
+
+    def columns(self, text):
+        """ columns of the unigrams and bigrams of the text in the vocabulary, repeated as many times as they occur """
+        tokens = TOKEN_PATTERN.findall(text.lower())
+        ngrams = tokens + [first + ' ' + second for first, second in zip(tokens, tokens[1:])]
+        return [self.vocabulary[ngram] for ngram in ngrams if ngram in self.vocabulary]
+
+    def predict(self, text):
+        """ returns the id of the predicted relation of a text """
+        decisions = self.weights[self.columns(text)].sum(axis=0) + self.intercepts
+        winners = np.where(decisions > 0, self.first_classes, self.second_classes)
+        votes = np.bincount(winners, minlength=len(self.classes))
+        return self.classes[int(np.argmax(votes))]
+
+    def predict_many(self, texts):
+        """ returns the list of the ids of the predicted relations of a list of texts """
+        return [self.predict(text) for text in texts]
+
+
+def load_relation_engine():
+    """ Opens the engine of the current classifier, training and exporting it first if it is missing """
+    path = engine_file()
+    if not os.path.exists(path):
+        from Relation_identifier import RelationIdentifier
+        print('\t\texporting', path, '...')
+        relation_identifier = RelationIdentifier()
+        relation_identifier.training()
+        export_engine(relation_identifier, path)
+    return RelationEngine(path)
@@ -0,0 +1,37 @@
+'''
+Author: Antonio Norelli
+NLP final project
+
+spacy_provider.py
+Provides a single spaCy English model to the whole process.
+The model is loaded the first time it is requested, only with the components used by the bot:
+the tagger (POS tags) and the dependency parser, the named entity recognizer is disabled.
+parse_many parses a list of texts in batches with nlp.pipe, for bulk callers (evaluation, offline answering).
+'''
+
+
+import threading
+
+SPACY_MODEL = 'en'
+DISABLED_COMPONENTS = ['ner']  # spacy_disambiguaton uses only POS tags and dependencies
+BATCH_SIZE = 64
+
+nlp = None
+nlp_lock = threading.Lock()
+
+
+def get_nlp():
+    """ returns the process-wide spaCy model, loading it on first use """
+    global nlp
+    with nlp_lock:
+        if nlp is None:
+            import spacy  # spaCy is a library for advanced natural language processing in Python and Cython. https://spacy.io/docs/usage/
+            print('\t\tloading model...')  # english nlp spacy model used for syntactic dependency parsing
+            nlp = spacy.load(SPACY_MODEL, disable=DISABLED_COMPONENTS)
+            print('\t\tmodel loaded')
+    return nlp
+
+
+def parse_many(texts, batch_size=BATCH_SIZE):
+    """ parses a list of texts in batches, returns the list of the spaCy documents """
+    return list(get_nlp().pipe(texts, batch_size=batch_size))
@@ -4,50 +4,84 @@ NLP final project
 
 telegram_chatbot.py
 This is the Telegram bot,
-it manages the interactions with the users calling the Answerer and the enrich_database function when needed.
+it manages the interactions with the users calling the Answerer and the enrichment worker when needed.
 the core function is "answer"
+The updates are answered by a pool of workers fed by a bounded queue (work_queue.py),
+when the queue is full the user is asked to try again later.
+The model is set up in background when the bot starts, until it is ready the users are asked to wait.
+If the setup fails the bot exits with an error status, so that a supervisor can restart it.
+The enriching questions are formulated in background and buffered for each domain (question_prefetcher.py),
+the enriching answers are processed in background too (enrichment_worker.py).
 '''
 
 
 import json
-import requests
+import http_client
+import sys
 import time
-import urllib
+import urllib.parse
 from Answerer import Answerer, domains_list
-from enrich_database import enrich_database
+from enrichment_worker import EnrichmentWorker
+from work_queue import ChatWorkQueue
+from question_prefetcher import QuestionPrefetcher
 
 
 
 TOKEN = "INSERT TELEGRAM BOT TOKEN"  # telegram bot token
 URL = "https://api.telegram.org/bot{}/".format(TOKEN)
-model = Answerer()  # initialization of the model for answering and querying
-print('setup done')
+LONG_POLLING_TIMEOUT = 100  # seconds, getUpdates waits up to this time for new updates
+BUSY_MESSAGE = "I am very busy right now, please try again in a moment"
+STATS_INTERVAL = 600  # seconds between two prints of the queue, answer cache, prefetcher and enrichment stats
+WARMING_UP_MESSAGE = "I am warming up, please try again in a moment"
+SETUP_FAILED_MESSAGE = "Sorry, I am out of order right now, please try again later"
+NO_QUESTION_MESSAGE = "I have no questions for you right now, please try again later"
+model = None  # model for answering and querying, initialized by start_model
+prefetcher = None  # buffers of enriching questions, started by start_model
+enrichment_worker = None  # processes the enriching answers, started by start_model
 
 
-def get_url(url):
+def start_model():
+    """ starts the initialization of the model in background, "setup done" is printed when it is ready """
+    global model, prefetcher, enrichment_worker
+    model = Answerer(background=True)
+    prefetcher = QuestionPrefetcher(model, domains_list())  # the refill starts when the model is ready
+    enrichment_worker = EnrichmentWorker(on_enriched=model.on_enriched, wait_ready=model.wait_ready)
+
+
+def model_ready():
+    return model is not None and model.ready.is_set()
+
+
+def model_failed():
+    return model is not None and model.setup_error is not None
+
+
+def get_url(url, timeout=None):
     """ reads the answer of the API called by the given url
 
     Parameters:
         url - given url
+        timeout - (connect timeout, read timeout) in seconds, the http_client ones if not given
 
     Returns:
         content - the json response of the API
     """
-    response = requests.get(url)
+    response = http_client.get(url, timeout=timeout)
     content = response.content.decode("utf8")
     return content
 
 
-def get_json_from_url(url):
+def get_json_from_url(url, timeout=None):
     """ converts the answer of the API called by the given url from the json format to python dicts
 
     Parameters:
         url - given url
+        timeout - (connect timeout, read timeout) in seconds, the http_client ones if not given
 
     Returns:
         js - the response in python dicts
     """
-    content = get_url(url)
+    content = get_url(url, timeout=timeout)
     js = json.loads(content)
     return js
 
@@ -61,10 +95,10 @@ def get_updates(offset=None):
     Returns:
         js - the response in python dicts
     """
-    url = URL + "getUpdates?timeout=100"  # timeout is used to avoid stress of the telegram server and the used machine
+    url = URL + "getUpdates?timeout={}".format(LONG_POLLING_TIMEOUT)  # timeout is used to avoid stress of the telegram server and the used machine
     if offset:
         url += "&offset={}".format(offset)
-    js = get_json_from_url(url)
+    js = get_json_from_url(url, timeout=(http_client.CONNECT_TIMEOUT, LONG_POLLING_TIMEOUT + 10))
     return js
 
 
@@ -165,25 +199,40 @@ def answer(update, chat, context, reset=False):
             text = 'Perfect! I am ready to answer'
             send_message(text, chat)
             step = 3
+        elif not model_ready() and ((user_input == 'I want to answer some questions' and step == 2) or step == 3):
+            print('\tModel not ready')
+            send_message(SETUP_FAILED_MESSAGE if model_failed() else WARMING_UP_MESSAGE, chat)
         elif user_input == 'I want to answer some questions' and step == 2:
             mode = 'enriching'
             print('\tMode:', mode)
             text = 'Ok, so my first question is:\n'
-            question = model.query(domain)
-            send_message(text + question["query"], chat,
-                         reply_markup=build_keyboard(['Question is misplaced',
-                                                      'Sorry, I have not an answer for this question']))
-            step = 3
+            question = prefetcher.take(domain)
+            if question is None:  # Babelnet not available or no more questions in the domain
+                mode = None
+                send_message(NO_QUESTION_MESSAGE, chat,
+                             reply_markup=build_keyboard(['I want to ask something',
+                                                          'I want to answer some questions']))
+            else:
+                send_message(text + question["query"], chat,
+                             reply_markup=build_keyboard(['Question is misplaced',
+                                                          'Sorry, I have not an answer for this question']))
+                step = 3
         elif mode == 'querying' and step == 3:
             text = model.answer(user_input, domain)
             print('\t\tAnswer:', text, '\n')
             send_message(text, chat)
         elif mode == 'enriching' and step == 3:
-            enrich_database(question["query"], user_input, domain, question["relation"], question["c1"])
-            question = model.query(domain)
-            send_message(question["query"], chat,
-                         reply_markup=build_keyboard(['Question is misplaced',
-                                                      'Sorry, I have not an answer for this question']))
+            enrichment_worker.submit(question["query"], user_input, domain, question["relation"], question["c1"])
+            question = prefetcher.take(domain)
+            if question is None:
+                mode, step = None, 2
+                send_message(NO_QUESTION_MESSAGE, chat,
+                             reply_markup=build_keyboard(['I want to ask something',
+                                                          'I want to answer some questions']))
+            else:
+                send_message(question["query"], chat,
+                             reply_markup=build_keyboard(['Question is misplaced',
+                                                          'Sorry, I have not an answer for this question']))
         context = (mode, domain, question, step)
         return context
     except Exception as e:  # catch exception to keep the bot running
@@ -194,14 +243,29 @@ def main():
     """ main function, enumerates updates and manages the interactions with multiple users
 
     every user interacting with the bot have its own context variables stored in the dict "chats"
-    that has as keys the id of each user
+    that has as keys the id of each user.
+    The updates are submitted to a bounded work queue, the updates of a chat are answered in order by its workers,
+    if the queue is full the update is discarded and the user is told that the bot is busy
     """
+    start_model()
     last_update_id = None
     mode, domain, question, step = None, None, None, 0
     context = (mode, domain, question, step)
     chats = {}
-    old_chat = 0
+
+    def answer_update(chat, update):
+        print('chat:', chat)
+        new_context = answer(update, chat, chats[chat], reset=False)
+        if new_context is None:  # answer failed and already printed the exception, the conversation restarts
+            new_context = context
+        chats[chat] = new_context
+
+    work_queue = ChatWorkQueue(answer_update)
+    last_stats = time.time()
     while True:
+        if model_failed():
+            print('exiting, the setup of the model failed:', model.setup_error)
+            sys.exit(1)
         updates = get_updates(last_update_id)
         if len(updates["result"]) > 0:
             last_update_id = get_last_update_id(updates) + 1
@@ -209,12 +273,16 @@ def main():
                 chat = update["message"]["chat"]["id"]
                 if chat not in chats:
                     chats[chat] = context
-                if chat != old_chat:
-                    print('chat:', chat)
-                old_chat = chat
-                chats[chat] = answer(update, chat, chats[chat], reset=False)
+                if not work_queue.submit(chat, update):
+                    print('chat:', chat, 'rejected, the queue is full')
+                    send_message(BUSY_MESSAGE, chat)
+        if time.time() - last_stats > STATS_INTERVAL:
+            print('queue stats:', work_queue.stats())
+            print('answer cache stats:', model.answer_cache.stats())
+            print('prefetcher stats:', prefetcher.stats())
+            print('enrichment stats:', enrichment_worker.stats())
+            last_stats = time.time()
         time.sleep(0.5)
 
-
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,128 @@
+'''
+Author: Antonio Norelli
+NLP final project
+
+templates.py
+Matcher of the query patterns (patterns_num.txt), such as "Where is X located ?".
+All the patterns are compiled in a single regular expression, an alternative per pattern with the most specific
+(longest literal text) first, so a question is recognized in one pass and the relation of the matching pattern
+is returned together with the literal text in place of X and Y.
+Patterns too generic to tell the relation (fewer than MIN_LITERAL_WORDS words, e.g. "Is X a Y ?") and patterns
+shared by different relations are not used to recognize a question, they can still be matched giving the relation.
+
+When executed standalone, it prints the matches of some example questions.
+'''
+
+
+import collections
+import re
+
+PATTERNS_FILE = '../data/patterns_num.txt'
+MIN_LITERAL_WORDS = 3  # a pattern with fewer literal words matches too many questions of other relations
+SLOT_PATTERN = re.compile(r'\b([XY])\b')
+
+Template = collections.namedtuple('Template', ['pattern', 'relation', 'specificity', 'literal_words'])
+
+
+def normalize(text):
+    """ text without the spaces around and the final question marks """
+    return text.strip().rstrip('?').strip()
+
+
+def read_templates(patterns_file=PATTERNS_FILE):
+    """ Reads the query patterns
+
+    Parameters:
+        patterns_file - one "pattern \t relation" per line, the relation is a relationId or a relation name
+
+    Returns:
+        list of Template, the relation is an int if it is a relationId, the upper case name otherwise
+    """
+    templates, seen = [], set()
+    with open(patterns_file, 'r') as f:
+        for line in f:
+            if '\t' not in line:
+                continue
+            pattern, relation = line.split('\t')
+            pattern, relation = normalize(pattern), relation.strip()
+            relation = int(relation) if relation.isdigit() else relation.upper()
+            if (pattern.lower(), relation) in seen:
+                continue
+            seen.add((pattern.lower(), relation))
+            literal = SLOT_PATTERN.sub('', pattern)
+            templates.append(Template(pattern, relation, len(literal), len(re.findall(r'\w+', literal))))
+    return templates
+
+
+def template_regex(pattern, number):
+    """ regular expression of a pattern, the text in place of X and Y is in the groups x<number> and y<number> """
+    regex = ''
+    for part in SLOT_PATTERN.split(pattern):
+        if part in ('X', 'Y'):
+            group = part.lower() + str(number)
+            regex += '(?P=' + group + ')' if '(?P<' + group + '>' in regex else '(?P<' + group + '>.+?)'
+        else:
+            regex += r'\s+'.join(re.escape(word) for word in part.split(' '))
+    return '(?P<t' + str(number) + '>' + regex + ')'
+
+
+class TemplateMatcher():
+    """ Single-pass matcher of the query patterns """
+    def __init__(self, patterns_file=PATTERNS_FILE, min_literal_words=MIN_LITERAL_WORDS):
+        self.templates = sorted(read_templates(patterns_file), key=lambda template: -template.specificity)
+        relations = collections.defaultdict(set)
+        for template in self.templates:
+            relations[template.pattern.lower()].add(template.relation)
+        recognizable = [number for number, template in enumerate(self.templates)
+                        if template.literal_words >= min_literal_words and len(relations[template.pattern.lower()]) == 1]
+        self.regex = self.compile(recognizable)
+        numbers = collections.defaultdict(list)  # relation - numbers of its templates
+        for number, template in enumerate(self.templates):
+            numbers[template.relation].append(number)
+        self.relation_regexes = {relation: self.compile(numbers[relation]) for relation in numbers}
+        recognizable = set(recognizable)
+        self.recognizable_regexes = {relation: self.compile([number for number in numbers[relation]
+                                                             if number in recognizable])
+                                     for relation in numbers if recognizable.intersection(numbers[relation])}
+
+    def compile(self, numbers):
+        return re.compile('|'.join(template_regex(self.templates[number].pattern, number) for number in numbers),
+                          re.IGNORECASE)
+
+    def match(self, text, relation=None, generic=True):
+        """ Matches a question against the patterns
+
+        Parameters:
+            text - input question
+            relation - if given, only the patterns of this relation are considered, generic ones included
+            generic - with a relation, if False the patterns too generic to recognize a question are not considered
+
+        Returns:
+            (relation, spans) - relation of the matching pattern and dict 'X'/'Y' - literal text, None if no match
+        """
+        if relation is None:
+            regex = self.regex
+        else:
+            regex = (self.relation_regexes if generic else self.recognizable_regexes).get(relation)
+        if regex is None:
+            return None
+        match = regex.fullmatch(normalize(text))
+        if match is None:
+            return None
+        number = int(match.lastgroup[1:])  # the group of the alternative is the last closed
+        spans = {}
+        for slot in ('X', 'Y'):
+            group = slot.lower() + str(number)
+            if group in regex.groupindex:
+                spans[slot] = match.group(group).strip()
+        return self.templates[number].relation, spans
+
+
+def main():
+    matcher = TemplateMatcher()
+    for question in ['Where is Brougham Hall located ?', 'Is De Berg Pass located in Lydenburg ?',
+                     'Is Waste Land a month?', 'Who is the best football player?']:
+        print(question, matcher.match(question))
+
+if __name__ == '__main__':
+    main()
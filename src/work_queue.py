@@ -0,0 +1,95 @@
+'''
+Author: Antonio Norelli
+NLP final project
+
+work_queue.py
+Bounded work queue between the intake of the Telegram updates and the Answerer.
+The updates are processed by a pool of worker threads, the updates of the same chat are processed one at a time,
+in arrival order, so the context variables of a chat are never used by two workers together.
+When the global or the per-chat limit of pending updates is exceeded, a new update is rejected:
+the caller can reply immediately that the bot is busy instead of making the latency grow without bound.
+Depth of the queue and waiting times are exposed by the "stats" method, to size the pool against real traffic.
+'''
+
+
+import collections
+import threading
+import time
+
+WORKERS = 4  # threads processing the updates
+MAX_PENDING = 64  # maximum number of updates waiting in the queue
+MAX_CHAT_PENDING = 3  # maximum number of updates of the same chat waiting in the queue
+WAIT_WINDOW = 100  # number of recent waiting times used for the average
+
+
+class ChatWorkQueue():
+    """ Bounded queue of per-chat work, processed by a pool of threads """
+    def __init__(self, handler, workers=WORKERS, max_pending=MAX_PENDING, max_chat_pending=MAX_CHAT_PENDING):
+        self.handler = handler  # function (chat, item) called by the workers
+        self.max_pending, self.max_chat_pending = max_pending, max_chat_pending
+        self.pending = {}  # chat - deque of (enqueue time, item)
+        self.ready = collections.deque()  # chats with pending items and no worker processing them
+        self.depth = 0
+        self.processed, self.rejected, self.failed = 0, 0, 0
+        self.max_wait = 0.
+        self.recent_waits = collections.deque(maxlen=WAIT_WINDOW)
+        self.condition = threading.Condition()
+        self.threads = [threading.Thread(target=self._work, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, chat, item):
+        """ Enqueues an item of a chat
+
+        Parameters:
+            chat - id of the chat
+            item - the work, passed to the handler
+
+        Returns:
+            True if the item is accepted, False if a limit is exceeded and the item is rejected
+        """
+        with self.condition:
+            chat_pending = self.pending.get(chat)
+            if self.depth >= self.max_pending or (chat_pending and len(chat_pending) >= self.max_chat_pending):
+                self.rejected += 1
+                return False
+            if chat_pending is None:
+                chat_pending = self.pending[chat] = collections.deque()
+                self.ready.append(chat)  # not in processing, otherwise its deque would exist
+            chat_pending.append((time.time(), item))
+            self.depth += 1
+            self.condition.notify()
+            return True
+
+    def _work(self):
+        while True:
+            with self.condition:
+                while not self.ready:
+                    self.condition.wait()
+                chat = self.ready.popleft()
+                enqueue_time, item = self.pending[chat].popleft()
+                self.depth -= 1
+                wait = time.time() - enqueue_time
+                self.recent_waits.append(wait)
+                self.max_wait = max(self.max_wait, wait)
+            try:
+                self.handler(chat, item)
+            except Exception as e:  # catch exception to keep the worker running
+                print(e)
+                with self.condition:
+                    self.failed += 1
+            with self.condition:
+                self.processed += 1
+                if self.pending[chat]:
+                    self.ready.append(chat)
+                    self.condition.notify()
+                else:
+                    del self.pending[chat]
+
+    def stats(self):
+        """ returns a dict with depth, counters and waiting times (seconds) of the queue """
+        with self.condition:
+            recent_waits = list(self.recent_waits)
+            return {"depth": self.depth, "chats": len(self.pending), "processed": self.processed,
+                    "rejected": self.rejected, "failed": self.failed, "max_wait": self.max_wait,
+                    "average_wait": sum(recent_waits) / len(recent_waits) if recent_waits else 0.}